@@ -0,0 +1,107 @@
+# This module publishes the data files of the map with the hash of
+# their content on their names, along with gzip and brotli versions
+# of them, so they can be cached for as long as the server allows.
+# A small loader (artifacts.js), the only file that has to be checked
+# on every visit, maps the names of the data files to the published
+# ones. Files of previous runs that are no longer on it are removed.
+# When the files are not published the loader is written as well, with
+# their own names, so the page loads only the files the builder wrote
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import gzip
+import hashlib
+import json
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Data files of the map, in the order the page loads them
+data_files = ['locations.py', 'locations_manifest.py', 'locations_compact.py', 'countries.py', 'user.py', 'clusters.py']
+
+# Folder of the published files, relative to the map files
+artifacts_dir = 'assets'
+
+# Loader of the published files
+loader_file = 'artifacts.js'
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the published name of a data file
+def getArtifactName(name, content):
+    content_hash = hashlib.sha256(content).hexdigest()[:12]
+    return '{}.{}.js'.format(os.path.splitext(name)[0], content_hash)
+
+# Write a file only if it doesn't exist yet. As its name has
+# the hash of its content, an existing one is the same file
+def writeArtifact(path, content):
+    if os.path.exists(path):
+        return
+    with open("{}.tmp".format(path), 'wb') as artifact_file:
+        artifact_file.write(content)
+    os.replace("{}.tmp".format(path), path)
+
+# Function to get the data files found on 'path', in
+# the order the page loads them
+def getDataFiles(path):
+    return [name for name in data_files if os.path.exists(os.path.join(path, name))]
+
+# Write the loader of the data files, mapping their names
+# to the ones the page loads them by
+def writeLoader(path, artifacts):
+    loader_path = os.path.join(path, loader_file)
+    with open("{}.tmp".format(loader_path), 'w') as loader_out:
+        loader_out.write("map_artifacts = {};\n".format(json.dumps(artifacts, indent=2)))
+    os.replace("{}.tmp".format(loader_path), loader_path)
+
+# Publish the data files found on 'path' and write the loader.
+# Returns the dictionary of data files to published files
+def publishArtifacts(path):
+    os.makedirs(os.path.join(path, artifacts_dir), exist_ok=True)
+
+    artifacts = dict()
+    for name in getDataFiles(path):
+        with open(os.path.join(path, name), 'rb') as data_file:
+            content = data_file.read()
+
+        artifact_path = '{}/{}'.format(artifacts_dir, getArtifactName(name, content))
+        writeArtifact(os.path.join(path, artifact_path), content)
+        writeArtifact(os.path.join(path, "{}.gz".format(artifact_path)), gzip.compress(content, 9, mtime=0))
+        if brotli is not None:
+            writeArtifact(os.path.join(path, "{}.br".format(artifact_path)), brotli.compress(content))
+        artifacts[name] = artifact_path
+
+    writeLoader(path, artifacts)
+
+    published = set()
+    for artifact_path in artifacts.values():
+        published.update([artifact_path, "{}.gz".format(artifact_path), "{}.br".format(artifact_path)])
+    for artifact_name in os.listdir(os.path.join(path, artifacts_dir)):
+        if '{}/{}'.format(artifacts_dir, artifact_name) not in published:
+            os.remove(os.path.join(path, artifacts_dir, artifact_name))
+
+    return artifacts
+
+# Remove the published files and write the loader of the
+# data files by their own names. Returns the data files
+def unpublishArtifacts(path):
+    removeArtifacts(path)
+    artifacts = dict((name, name) for name in getDataFiles(path))
+    writeLoader(path, artifacts)
+    return artifacts
+
+# Remove the published files and their loader
+def removeArtifacts(path):
+    if os.path.exists(os.path.join(path, artifacts_dir)):
+        for artifact_name in os.listdir(os.path.join(path, artifacts_dir)):
+            os.remove(os.path.join(path, artifacts_dir, artifact_name))
+    if os.path.exists(os.path.join(path, loader_file)):
+        os.remove(os.path.join(path, loader_file))
@@ -0,0 +1,196 @@
+# This module implements an asyncio client for the Flickr REST api.
+# It keeps a pool of keep-alive HTTP connections open, so the calls
+# of a run share the same connections instead of opening new ones,
+# and many calls can be in flight at the same time. Requests are signed
+# with OAuth, as flickrapi signs them, so the methods and the privacy
+# filters that need the token of the user work the same way
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import asyncio
+import gzip
+import json
+import ssl
+
+from urllib.parse import urlencode, urlsplit
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Flickr REST api endpoint
+flickr_endpoint = 'https://www.flickr.com/services/rest/'
+
+# Seconds to wait for a response
+default_timeout = 60
+
+
+# ===============================================================
+
+# Error returned by the api, or HTTP error status
+class FlickrError(Exception):
+
+    def __init__(self, message, code=None, status=None):
+        super().__init__(message)
+        self.code = code
+        self.status = status
+
+
+# Client for the Flickr api with a pool of connections
+class FlickrAsyncClient:
+
+    # 'oauth_client' is the oauthlib client requests are signed with,
+    # as the one of flickrapi (flickr.flickr_oauth.oauth.client), which
+    # has the token of the user if there is one. None to not sign them
+    def __init__(self, api_key, endpoint=flickr_endpoint, pool_size=4, timeout=default_timeout, oauth_client=None):
+        url = urlsplit(endpoint)
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.oauth_client = oauth_client
+        self.secure = url.scheme == 'https'
+        self.host = url.hostname
+        self.port = url.port or (443 if self.secure else 80)
+        self.path = url.path or '/'
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context() if self.secure else None
+        self.idle = []
+        self.slots = None
+        self.connections_opened = 0
+        self.bytes_received = 0
+
+    # Call an api method and return the parsed json response
+    async def call(self, method, **params):
+        params['method'] = method
+        params['api_key'] = self.api_key
+        params['format'] = 'json'
+        params['nojsoncallback'] = 1
+        query = urlencode(params)
+        target = '{}?{}'.format(self.path, query)
+
+        headers = dict()
+        if self.oauth_client is not None:
+            uri, headers, body = self.oauth_client.sign('{}?{}'.format(self.endpoint, query), http_method='GET')
+
+        status, reason, body = await asyncio.wait_for(self.request(target, headers), self.timeout)
+        if status != 200:
+            raise FlickrError('HTTP Error {}: {}'.format(status, reason), status=status)
+
+        response = json.loads(body)
+        if response.get('stat') != 'ok':
+            raise FlickrError('Error: {}: {}'.format(response.get('code'), response.get('message')), code=response.get('code'), status=status)
+        return response
+
+    # Close all idle connections
+    async def close(self):
+        while len(self.idle) > 0:
+            reader, writer = self.idle.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    # Send a request on a pooled connection. If a reused connection was
+    # closed by the server in the meantime, the request is sent again
+    # on a new connection
+    async def request(self, target, headers=None):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.pool_size)
+
+        async with self.slots:
+            reused = len(self.idle) > 0
+            connection = self.idle.pop() if reused else await self.connect()
+            try:
+                status, reason, body, keep_alive = await self.exchange(connection, target, headers)
+            except (OSError, ConnectionError, asyncio.IncompleteReadError):
+                self.discard(connection)
+                if not reused:
+                    raise
+                connection = await self.connect()
+                try:
+                    status, reason, body, keep_alive = await self.exchange(connection, target, headers)
+                except BaseException:
+                    self.discard(connection)
+                    raise
+            except BaseException:
+                self.discard(connection)
+                raise
+
+            if keep_alive:
+                self.idle.append(connection)
+            else:
+                self.discard(connection)
+
+        return status, reason, body
+
+    # Open a new connection to the api host
+    async def connect(self):
+        connection = await asyncio.open_connection(self.host, self.port, ssl=self.ssl_context)
+        self.connections_opened += 1
+        return connection
+
+    # Close a connection that can not be reused
+    def discard(self, connection):
+        connection[1].close()
+
+    # Write a GET request, with the extra 'headers', and read its response
+    async def exchange(self, connection, target, headers=None):
+        reader, writer = connection
+
+        host = self.host
+        if self.port != (443 if self.secure else 80):
+            host = '{}:{}'.format(self.host, self.port)
+
+        extra_headers = ''
+        for name, value in (headers or dict()).items():
+            extra_headers += '{}: {}\r\n'.format(name, value)
+
+        writer.write(('GET {} HTTP/1.1\r\n'
+                      'Host: {}\r\n'
+                      'Accept-Encoding: gzip\r\n'
+                      'Connection: keep-alive\r\n'
+                      '{}'
+                      '\r\n').format(target, host, extra_headers).encode('ascii'))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if len(status_line) == 0:
+            raise ConnectionError('Connection closed by server')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = await self.readChunked(reader)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+
+        self.bytes_received += len(body)
+
+        if headers.get('content-encoding', '').lower() == 'gzip':
+            body = gzip.decompress(body)
+
+        return int(status), reason, body, keep_alive
+
+    # Read a body sent with chunked transfer encoding
+    async def readChunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # skip trailers
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
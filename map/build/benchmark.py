@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+# This script benchmarks the map builder on synthetic photostreams of
+# increasing size. Photos are generated and served by the stand-in of
+# the api, with a few dense places taking most of them, as on real maps,
+# and the map builder (generate-map-data.py) runs against it offline, on
+# a temporary folder with its config file pointed to the stand-in and
+# to a synthetic grid of countries (or a GeoJSON file of countries). The
+# time and the peak memory of each stage (fetch, extraction, merge,
+# loading of the polygons, geocoding, ordering and writing of the data
+# files) are taken from the metrics file of the run and printed, along
+# with the time per photo, which should stay the same as the
+# photostreams grow. Results can be saved as json and compared against
+# a baseline saved by a previous run, so regressions are flagged (with
+# exit status 1)
+#
+# Usage: ./benchmark.py [number of photos ...] [--output results.json]
+#                       [--baseline baseline.json [--save-baseline]]
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+
+from flickr_server import generatePhotostream, synthetic_user, StandInServer
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Sizes of the synthetic photostreams
+default_sizes = [1000, 10000, 100000, 1000000]
+
+# Seed, so all runs use the same photostreams
+seed = 0
+
+# Size, in degrees, of the countries of the synthetic grid,
+# and number of vertices on each side of their polygons
+grid_country_size = 10
+grid_side_vertices = 100
+
+# Stages of the map builder, as the phases of its metrics
+stages = [
+    ('fetch', ['count', 'fetch']),
+    ('extract', ['filter', 'checkpoint']),
+    ('merge', ['load_map', 'merge']),
+    ('polygons', ['load_polygons']),
+    ('geocode', ['resolve_countries', 'getCountryInfo']),
+    ('order', ['order']),
+    ('write', ['write_locations', 'write_clusters', 'write_caches', 'write_countries', 'write_user', 'publish_artifacts'])
+]
+
+# A stage is flagged when it takes longer than the baseline by
+# this factor, and at least this many seconds longer, or when it
+# takes more memory than the baseline by the same factor
+default_threshold = 1.25
+min_time_regression = 0.05
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Write a GeoJSON file of a grid of square countries covering
+# the world, with as many vertices as real coastlines would have
+def writeGridCountries(path):
+    codes = [a + b for a in string.ascii_uppercase for b in string.ascii_uppercase]
+    features = []
+    for longitude in range(-180, 180, grid_country_size):
+        for latitude in range(-90, 90, grid_country_size):
+            step = grid_country_size / float(grid_side_vertices)
+            ring = []
+            for i in range(grid_side_vertices):
+                ring.append([longitude + i * step, latitude])
+            for i in range(grid_side_vertices):
+                ring.append([longitude + grid_country_size, latitude + i * step])
+            for i in range(grid_side_vertices):
+                ring.append([longitude + grid_country_size - i * step, latitude + grid_country_size])
+            for i in range(grid_side_vertices):
+                ring.append([longitude, latitude + grid_country_size - i * step])
+            ring.append(ring[0])
+            code = codes[len(features)]
+            features.append({
+                'type': 'Feature',
+                'properties': {'ISO_A2': code, 'NAME': 'Country {}'.format(code)},
+                'geometry': {'type': 'Polygon', 'coordinates': [ring]}
+            })
+    with open(path, 'w') as geojson_file:
+        json.dump({'type': 'FeatureCollection', 'features': features}, geojson_file)
+
+# Write the files of a run of the map builder on folder 'run_path':
+# the script itself, its config file, with 'settings' replacing the
+# ones of the config file next to this script, and its credentials
+def writeRunFiles(run_path, settings):
+    build_path = os.path.dirname(os.path.realpath(__file__))
+    shutil.copy(os.path.join(build_path, 'generate-map-data.py'), run_path)
+
+    with open(os.path.join(build_path, 'config.py'), 'r') as config_file:
+        config_text = config_file.read()
+    config_text += '\n# Settings of the benchmark\n'
+    for name in settings:
+        config_text += '{} = {!r}\n'.format(name, settings[name])
+    with open(os.path.join(run_path, 'config.py'), 'w') as config_file:
+        config_file.write(config_text)
+
+    with open(os.path.join(run_path, 'api_credentials.py'), 'w') as credentials_file:
+        credentials_file.write("api_key = 'benchmark'\napi_secret = 'benchmark'\n")
+
+# Run the map builder on folder 'run_path'. Its modules are
+# imported from the folder of this script. Returns its metrics
+def runBuilder(run_path):
+    build_path = os.path.dirname(os.path.realpath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([build_path] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+
+    process = subprocess.run([sys.executable, os.path.join(run_path, 'generate-map-data.py')], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    metrics_files = sorted(glob.glob(os.path.join(run_path, 'metrics', 'metrics-*.json')))
+    if process.returncode != 0 or os.path.exists(os.path.join(run_path, 'fatal')) or len(metrics_files) == 0:
+        log = ''
+        if os.path.exists(os.path.join(run_path, 'map.log')):
+            with open(os.path.join(run_path, 'map.log'), 'r') as log_file:
+                log = ''.join(log_file.readlines()[-10:])
+        raise RuntimeError('The map builder failed\n{}{}'.format(log, process.stderr.decode('utf-8', 'replace')))
+
+    with open(metrics_files[-1], 'r') as metrics_file:
+        return json.load(metrics_file)
+
+# Function to get the results of each stage of a run of the map
+# builder on 'n_photos' photos, and of the whole run, from its metrics
+def getResults(n_photos, report):
+    markers = report['counters'].get('markers', 0)
+    results = []
+    peaks = []
+    for stage, phases in stages:
+        time = 0.0
+        peak_mb = None
+        for name in phases:
+            phase = report['phases'].get(name)
+            if phase is None:
+                continue
+            time += phase['time']
+            if phase.get('peak_mb') is not None:
+                peak_mb = max(peak_mb or 0, phase['peak_mb'])
+        if peak_mb is not None:
+            peaks.append(peak_mb)
+        results.append({'photos': n_photos, 'stage': stage, 'markers': markers, 'time': round(time, 4), 'peak_mb': peak_mb})
+    results.append({'photos': n_photos, 'stage': 'total', 'markers': markers, 'time': report['duration'], 'peak_mb': max(peaks) if len(peaks) > 0 else None})
+    for result in results:
+        result['us_per_photo'] = round(1000000 * result['time'] / n_photos, 3)
+    return results
+
+# Run the map builder on a photostream of 'n_photos' photos,
+# served by the stand-in of the api. Returns a list of results,
+# one per stage and one of the whole run
+def runBenchmark(n_photos, geojson_path, settings):
+    server = StandInServer(generatePhotostream(n_photos, seed), port=0)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as run_path:
+            run_settings = {
+                'user': synthetic_user['alias'],
+                'photoset_id': '',
+                'api_endpoint': server.getEndpoint(),
+                'requests_per_hour': 0,
+                'countries_geojson': geojson_path,
+                'metrics_dir': 'metrics',
+                'metrics_keep': 0
+            }
+            run_settings.update(settings)
+            writeRunFiles(run_path, run_settings)
+            report = runBuilder(run_path)
+    finally:
+        server.stop()
+    return getResults(n_photos, report)
+
+# Compare results against the ones of a baseline. Returns a
+# list of messages, one per stage that regressed
+def compareResults(results, baseline, threshold):
+    baseline_index = dict(((result['photos'], result['stage']), result) for result in baseline)
+    regressions = []
+    for result in results:
+        base = baseline_index.get((result['photos'], result['stage']))
+        if base is None:
+            continue
+        if result['time'] > base['time'] * threshold and result['time'] - base['time'] >= min_time_regression:
+            regressions.append('{} photos, {}: time {:.3f}s, was {:.3f}s'.format(result['photos'], result['stage'], result['time'], base['time']))
+        if result.get('peak_mb') is None or base.get('peak_mb') is None:
+            continue
+        if result['peak_mb'] > base['peak_mb'] * threshold and result['peak_mb'] - base['peak_mb'] >= 1:
+            regressions.append('{} photos, {}: peak memory {:.2f}MB, was {:.2f}MB'.format(result['photos'], result['stage'], result['peak_mb'], base['peak_mb']))
+    return regressions
+
+# Function to get the lines of the report of the time per photo of
+# each stage over the sizes benchmarked, and how much it grew from
+# the smallest to the largest one. It stays the same if the stage
+# scales linearly with the number of photos
+def getLinearityReport(results):
+    sizes = sorted(set(result['photos'] for result in results))
+    index = dict(((result['photos'], result['stage']), result) for result in results)
+    lines = ['{:>10} '.format('us/photo') + ' '.join('{:>10}'.format(n_photos) for n_photos in sizes) + ' {:>8}'.format('growth')]
+    for stage in [name for name, phases in stages] + ['total']:
+        values = [index[(n_photos, stage)]['us_per_photo'] for n_photos in sizes]
+        growth = '-'
+        if values[0] > 0:
+            growth = 'x{:.2f}'.format(values[-1] / values[0])
+        lines.append('{:>10} '.format(stage) + ' '.join('{:>10.3f}'.format(value) for value in values) + ' {:>8}'.format(growth))
+    return lines
+
+
+#===== MAIN CODE ==============================================================#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark of the map builder on synthetic photostreams')
+    parser.add_argument('sizes', type=int, nargs='*', default=default_sizes, help='number of photos of each photostream')
+    parser.add_argument('--geojson', help='GeoJSON of the countries, instead of a synthetic grid')
+    parser.add_argument('--cluster-distance', type=float, default=0, help='cluster markers within this distance (metres)')
+    parser.add_argument('--workers', type=int, default=1, help='processes to geocode the markers with')
+    parser.add_argument('--fetch-workers', type=int, default=1, help='pages of photos fetched at the same time')
+    parser.add_argument('--async-client', action='store_true', help='fetch the pages with the asyncio client')
+    parser.add_argument('--output-mode', default='single', help='output of the markers: single, compact or shards')
+    parser.add_argument('--output', help='save the results to this json file')
+    parser.add_argument('--baseline', help='json file of results to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--threshold', type=float, default=default_threshold, help='ratio to the baseline flagged as a regression')
+    args = parser.parse_args()
+
+    settings = {
+        'cluster_distance': args.cluster_distance,
+        'resolver_workers': args.workers,
+        'fetch_workers': args.fetch_workers,
+        'async_client': args.async_client,
+        'output_mode': args.output_mode
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as grid_path:
+        geojson_path = args.geojson
+        if geojson_path is None:
+            geojson_path = os.path.join(grid_path, 'countries.geojson')
+            writeGridCountries(geojson_path)
+        geojson_path = os.path.realpath(geojson_path)
+
+        print('{:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format('photos', 'stage', 'markers', 'time (s)', 'us/photo', 'memory (MB)'))
+
+        for n_photos in args.sizes:
+            for result in runBenchmark(n_photos, geojson_path, settings):
+                memory = '-' if result['peak_mb'] is None else '{:.2f}'.format(result['peak_mb'])
+                print('{:>10} {:>10} {:>10} {:>10.3f} {:>10.3f} {:>12}'.format(result['photos'], result['stage'], result['markers'], result['time'], result['us_per_photo'], memory))
+                results.append(result)
+
+    print('')
+    for line in getLinearityReport(results):
+        print(line)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline is not None:
+        if args.save_baseline or not os.path.exists(args.baseline):
+            with open(args.baseline, 'w') as baseline_file:
+                json.dump(results, baseline_file, indent=2)
+            print('Saved baseline to {}'.format(args.baseline))
+        else:
+            with open(args.baseline, 'r') as baseline_file:
+                regressions = compareResults(results, json.load(baseline_file), args.threshold)
+            for regression in regressions:
+                print('Regression: {}'.format(regression))
+            if len(regressions) > 0:
+                sys.exit(1)
+            print('No regressions against {}'.format(args.baseline))
@@ -0,0 +1,94 @@
+# This module keeps a checkpoint of the extraction of photos, so an
+# interrupted run can be resumed from the last page processed. The
+# checkpoint is a file of json lines: the first one describes the run
+# and each of the others has the photos added to the map by one page
+# and the counters after it. Lines are only appended, so saving a page
+# costs the same no matter how many pages were processed before it, and
+# they are read back one at a time, so resuming doesn't hold the photos
+# of all pages on memory
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import json
+import os
+
+
+#===== FUNCTIONS ==============================================================#
+
+# Start a new checkpoint, replacing any previous one
+def startCheckpoint(path, run_info):
+    with open(path, 'w') as checkpoint_file:
+        checkpoint_file.write('{}\n'.format(json.dumps({'run': run_info})))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+# Append a processed page to the checkpoint. 'photos' is the
+# list of [longitude, latitude, id, thumb url] added by the page
+def saveCheckpoint(path, pg, counters, photos):
+    with open(path, 'a') as checkpoint_file:
+        checkpoint_file.write('{}\n'.format(json.dumps({'page': pg, 'counters': counters, 'photos': photos})))
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+# Generator of the entries of a checkpoint, with the size of the file
+# up to the end of each one. A line cut in half by an interruption
+# ends it, along with anything after it
+def readCheckpoint(path):
+    size = 0
+    with open(path, 'rb') as checkpoint_file:
+        for line in checkpoint_file:
+            if not line.endswith(b'\n'):
+                return
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                return
+            size += len(line)
+            yield entry, size
+
+# Load a checkpoint. Returns the run info, the last page saved, the
+# counters after it and the size of the valid part of the file, or
+# None if there is no valid checkpoint. The photos are not loaded
+def loadCheckpoint(path):
+    if not os.path.exists(path):
+        return None
+
+    run_info = None
+    last_pg = 0
+    counters = dict()
+    size = 0
+
+    for entry, size in readCheckpoint(path):
+        if run_info is None:
+            run_info = entry.get('run')
+            if run_info is None:
+                return None
+            continue
+        last_pg = entry['page']
+        counters = entry['counters']
+
+    if run_info is None:
+        return None
+
+    return run_info, last_pg, counters, size
+
+# Generator of the photos of the pages saved on a checkpoint, up
+# to 'size' bytes of it, as returned by 'loadCheckpoint'
+def getCheckpointPhotos(path, size):
+    for entry, end in readCheckpoint(path):
+        if end > size:
+            return
+        for photo in entry.get('photos', []):
+            yield photo
+
+# Drop what is after the valid part of a checkpoint, so
+# the next pages are appended right after the last one
+def truncateCheckpoint(path, size):
+    with open(path, 'r+b') as checkpoint_file:
+        checkpoint_file.truncate(size)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+
+# Remove the checkpoint when the run has finished
+def removeCheckpoint(path):
+    if os.path.exists(path):
+        os.remove(path)
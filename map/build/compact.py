@@ -0,0 +1,156 @@
+# This module writes the markers of the map on a compact columnar
+# format. Coordinates are fixed precision integers, photo ids are
+# numbers and, of the thumbnail url of each photo, only its server
+# and secret are kept, the url is rebuilt from a template. Columns
+# are typed arrays encoded in base64, so the page decodes them at
+# once instead of parsing a literal of lists and strings. Markers
+# are in country order, and each one points to its first photo
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import array
+import base64
+import re
+import sys
+
+from geocache import importCache
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Compact file of the markers
+compact_file = 'locations_compact.py'
+
+# Coordinates are stored multiplied by this value. Flickr
+# gives them with 6 decimal places, so none are lost
+coords_precision = 1000000
+
+# Template of the thumbnail urls, and a pattern to get
+# the server, id and secret back from each url
+thumb_template = 'https://live.staticflickr.com/{server}/{id}_{secret}_s.jpg'
+thumb_pattern = re.compile(r'^https://live\.staticflickr\.com/(\d+)/(\d{1,15})_([0-9a-f]{10})_s\.jpg$')
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the bytes of an array, on little-endian order
+def getArrayBytes(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+# Function to get an array from its little-endian bytes
+def getBytesArray(typecode, data, start, n):
+    values = array.array(typecode)
+    values.frombytes(data[start:start + n * values.itemsize])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+# Function to get the thumbnail url of a photo from its parts
+def getThumbUrl(server, photo_id, secret):
+    return thumb_template.format(server=server, id=photo_id, secret='{:010x}'.format(secret))
+
+# Encode locations dictionary on the compact format. Photos whose
+# thumbnail can't be rebuilt from the template keep their id and
+# url as they are. Returns the dictionary to be written
+def encodeCompact(locations_dict):
+    countries = []
+    longitudes = array.array('i')
+    latitudes = array.array('i')
+    offsets = array.array('I', [0])
+    ids = array.array('d')
+    secrets = array.array('d')
+    servers = array.array('I')
+    photos = dict()
+
+    for country_code in locations_dict:
+        countries.append([country_code, len(locations_dict[country_code])])
+        for marker in locations_dict[country_code]:
+            longitudes.append(int(round(marker[0][0] * coords_precision)))
+            latitudes.append(int(round(marker[0][1] * coords_precision)))
+            for photo in marker[1]:
+                match = thumb_pattern.match(photo[1])
+                if match is not None and getThumbUrl(int(match.group(1)), photo[0], int(match.group(3), 16)) == photo[1] and str(int(photo[0])) == photo[0]:
+                    ids.append(int(photo[0]))
+                    secrets.append(int(match.group(3), 16))
+                    servers.append(int(match.group(1)))
+                else:
+                    photos[len(ids)] = [photo[0], photo[1]]
+                    ids.append(0)
+                    secrets.append(0)
+                    servers.append(0)
+            offsets.append(len(ids))
+
+    # the arrays of 8 bytes go first, so all arrays are aligned
+    data = b''.join([getArrayBytes(ids), getArrayBytes(secrets), getArrayBytes(longitudes),
+                     getArrayBytes(latitudes), getArrayBytes(offsets), getArrayBytes(servers)])
+
+    return {
+        'precision': coords_precision,
+        'thumb_url': thumb_template,
+        'countries': countries,
+        'markers': len(longitudes),
+        'photos': len(ids),
+        'other_photos': photos,
+        'data': base64.b64encode(data).decode('ascii')
+    }
+
+# Decode the compact format back to a locations dictionary
+def decodeCompact(compact):
+    data = base64.b64decode(compact['data'])
+    n_markers = compact['markers']
+    n_photos = compact['photos']
+    precision = float(compact['precision'])
+    other_photos = compact['other_photos']
+
+    start = 0
+    ids = getBytesArray('d', data, start, n_photos)
+    start += 8 * n_photos
+    secrets = getBytesArray('d', data, start, n_photos)
+    start += 8 * n_photos
+    longitudes = getBytesArray('i', data, start, n_markers)
+    start += 4 * n_markers
+    latitudes = getBytesArray('i', data, start, n_markers)
+    start += 4 * n_markers
+    offsets = getBytesArray('I', data, start, n_markers + 1)
+    start += 4 * (n_markers + 1)
+    servers = getBytesArray('I', data, start, n_photos)
+
+    locations_dict = dict()
+    m = 0
+    for country_code, country_markers in compact['countries']:
+        markers = []
+        for i in range(country_markers):
+            photos = []
+            for p in range(offsets[m], offsets[m+1]):
+                if p in other_photos:
+                    photos.append(list(other_photos[p]))
+                    continue
+                photo_id = str(int(ids[p]))
+                photos.append([photo_id, compact['thumb_url'].format(server=servers[p], id=photo_id, secret='{:010x}'.format(int(secrets[p])))])
+            markers.append([[longitudes[m] / precision, latitudes[m] / precision], photos])
+            m += 1
+        locations_dict[country_code] = markers
+    return locations_dict
+
+# Write locations dictionary to a compact file
+def writeCompact(path, locations_dict):
+    compact = encodeCompact(locations_dict)
+    compact_out = open(path, 'w')
+    compact_out.write("locations_compact = {\n")
+    i = 1
+    for key in compact:
+        compact_out.write("  \'{}\': {}".format(key, repr(compact[key])))
+        if i < len(compact):
+            compact_out.write(",\n")
+        else:
+            compact_out.write("\n")
+        i += 1
+    compact_out.write("}\n")
+    compact_out.close()
+
+# Load locations dictionary from a compact file
+def loadCompact(path):
+    return decodeCompact(importCache(path, 'locations_compact'))
@@ -30,3 +30,126 @@ geo_privacy = 1
 # Photos with this tag
 # won't be included on map
 dont_map_tag = 'DontMap'
+
+# Number of pages of photos fetched
+# from Flickr at the same time
+# 1 = one page at a time
+fetch_workers = 1
+
+# Use the asyncio client, which keeps a pool
+# of connections open to Flickr, gets the user
+# info and the total of photos at the same time
+# and requests the next pages ahead
+# (fetch_workers is the number of connections)
+async_client = False
+
+# Maximum number of requests per hour
+# made to the Flickr api, shared by all
+# calls (Flickr allows 3600 per api key)
+# 0 = no limit
+requests_per_hour = 3600
+
+# Fetch Mode:
+# 'photos' = request all photos and
+#            check them for geo tags here
+# 'search' = request only the geotagged photos
+#            (flickr.photos.search, photostream only).
+#            Photos are still checked here as well
+fetch_mode = 'photos'
+
+# Natural Earth admin-0 countries file
+# (GeoJSON), relative to this folder.
+# If defined, the countries of the markers
+# are found offline on its polygons
+countries_geojson = ''
+
+# Number of processes resolving the countries
+# of the new markers on the polygons above
+# (1 to resolve them on this process only)
+resolver_workers = 1
+
+# Format of the geocoding caches:
+# 'binary' = memory-mapped files (matrix.bin and
+#            coords.bin), only changes are written.
+#            Existing matrix.py and coords.py are
+#            converted on first run
+# 'python' = Python literal modules (matrix.py
+#            and coords.py), rewritten on every run
+cache_format = 'binary'
+
+# Precision, in degrees, of the coordinates
+# on the cache of their countries. Nearby
+# points share the same entry (0.001 is
+# about 110m). 0 to use only the caches above
+geocode_precision = 0
+
+# Maximum number of entries on that cache.
+# The least recently used ones are evicted
+geocode_cache_size = 100000
+
+# Distance, in metres, within which photos
+# are clustered on the same marker, which
+# keeps the coordinates of its first photo.
+# 0 to merge only photos on the same exact
+# coordinates
+cluster_distance = 0
+
+# Build the clusters of the markers on each
+# zoom of the map (clusters.py), so the page
+# adds only the clusters of the current zoom
+cluster_pyramid = False
+
+# Output of the markers:
+# 'single'  = all markers on locations.py
+# 'compact' = all markers on a columnar
+#             file (locations_compact.py),
+#             several times smaller
+# 'shards'  = one file per country (folder
+#             locations) and a manifest of
+#             them (locations_manifest.py),
+#             loaded by the page when needed
+output_mode = 'single'
+
+# Publish the data files with the hash of their
+# content on their names, plus their gzip and
+# brotli (if the module is installed) versions,
+# on the folder assets. The page loads them by
+# artifacts.js, so they can be cached for long
+publish_artifacts = False
+
+# Flickr api endpoint. Leave it empty to use
+# Flickr, or set it to the local stand-in
+# server (flickr_server.py) to run offline:
+# 'http://127.0.0.1:8642/services/rest/'
+api_endpoint = ''
+
+# Folder of the json files with the metrics
+# of each run: time of each phase, latency
+# of the api calls, retries and bytes received.
+# Leave it empty to not write them
+metrics_dir = ''
+
+# Number of metrics files kept on that
+# folder. The ones of older runs are
+# removed. 0 to keep all of them
+metrics_keep = 30
+
+# Level of the records written to the log
+# (map.log): 'DEBUG', 'INFO', 'WARNING',
+# 'ERROR' or 'CRITICAL'. On 'DEBUG' every
+# page and marker added is logged, otherwise
+# at most one of them every interval of
+# 'log_progress_interval' seconds
+log_level = 'INFO'
+log_progress_interval = 10
+
+# Size, in bytes, the log grows up to before
+# it's rotated, and number of rotated logs
+# kept (map.log.1, map.log.2, ...)
+log_max_size = 1048576
+log_backups = 3
+
+# Maximum number of pages of photos (500 photos
+# each) processed, from the newest ones. 0 to
+# process all photos on photostream
+max_pages = 0
@@ -0,0 +1,349 @@
+# This module resolves the country of a coordinate offline, testing it
+# against the Natural Earth admin-0 country polygons, the same source
+# 'countries_bbox.js' was extracted from. Download the countries as
+# GeoJSON (the 1:10m scale is recommended, as its coastlines are close
+# enough for photos taken on small islands) from
+# https://www.naturalearthdata.com/downloads/10m-cultural-vectors/
+#
+# A grid of cells indexes the polygons by their bounding boxes, so a
+# point is only tested against the polygons around it. The edges of
+# each polygon are grouped by grid row, so the exact point-in-polygon
+# test only goes through the edges on the row of the point, and cells
+# that no edge crosses are known to be entirely inside or outside.
+#
+# Many points can be resolved at once with 'resolveBatch'. If NumPy is
+# installed, the points are grouped by cell and each group is filtered
+# and tested against the polygons of its cell in vectorized passes,
+# optionally split among a pool of processes
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import json
+import math
+import multiprocessing
+import os
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Size, in degrees, of the cells of the grid
+cell_size = 1.0
+
+# Height, in degrees, of the rows the edges of the
+# polygons are grouped by for the point-in-polygon test
+row_size = cell_size / 16
+
+# Points outside all polygons, but closer than this
+# distance (in degrees) to a country, are set to it
+max_distance = 0.05
+
+# Maximum number of point and edge pairs tested
+# at once on the vectorized point-in-polygon test
+max_batch_pairs = 1000000
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the grid cell of a coordinate
+def getCell(longitude, latitude):
+    return (int(math.floor(longitude / cell_size)), int(math.floor(latitude / cell_size)))
+
+# Function to get the row of the edges of a latitude
+def getRow(latitude):
+    return int(math.floor(latitude / row_size))
+
+# Function to get the code of a country from the properties of its feature.
+# Some countries have no ISO code on Natural Earth (-99), so the one
+# used by the map is tried next
+def getCountryCode(properties):
+    keys = dict((key.lower(), key) for key in properties)
+    for key in ['iso_a2', 'iso_a2_eh', 'wb_a2']:
+        if key in keys:
+            code = str(properties[keys[key]])
+            if len(code) == 2 and code.isalpha():
+                return code.upper()
+    return ''
+
+# Function to get the name of a country from the properties of its feature
+def getCountryName(properties):
+    keys = dict((key.lower(), key) for key in properties)
+    for key in ['name', 'name_en', 'admin']:
+        if key in keys and properties[keys[key]]:
+            return properties[keys[key]]
+    return ''
+
+# Load the names of the countries from 'countries_bbox.js', so new
+# countries get the same names used by the map
+def loadCountryNames(path):
+    names = dict()
+    if os.path.exists(path):
+        with open(path, 'r') as names_file:
+            for code, name in re.findall(r"'([A-Z]{2})': \['((?:[^'\\]|\\.)*)'", names_file.read()):
+                names[code] = name.replace("\\'", "'")
+    return names
+
+# Resolve a chunk of points on a process of the pool. The resolver
+# is inherited from the parent process when the pool is forked
+def resolveChunk(points):
+    return pool_resolver.resolveBatch(points)
+
+# Function to get the distance from a point to a segment
+def getSegmentDistance(x, y, x1, y1, x2, y2):
+    dx = x2 - x1
+    dy = y2 - y1
+    if dx == 0 and dy == 0:
+        return math.hypot(x - x1, y - y1)
+    t = max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(x - (x1 + t * dx), y - (y1 + t * dy))
+
+
+#===== CLASSES ================================================================#
+
+# Polygon of a country, with its rings (outer and holes) split
+# into edges grouped by row and by the grid cells they cross
+class CountryPolygon:
+
+    def __init__(self, code, name, rings):
+        self.code = code
+        self.name = name
+        self.rows = dict()
+        self.boundary = dict()
+        self.cells = dict()
+        self.row_arrays = dict()
+
+        xs = [point[0] for ring in rings for point in ring]
+        ys = [point[1] for ring in rings for point in ring]
+        self.bbox = [min(xs), min(ys), max(xs), max(ys)]
+
+        for ring in rings:
+            for i in range(len(ring)):
+                x1, y1 = ring[i-1][0], ring[i-1][1]
+                x2, y2 = ring[i][0], ring[i][1]
+                if x1 == x2 and y1 == y2:
+                    continue
+                edge = (x1, y1, x2, y2)
+                for row in range(getRow(min(y1, y2)), getRow(max(y1, y2))+1):
+                    self.rows.setdefault(row, []).append(edge)
+                col_min, row_min = getCell(min(x1, x2), min(y1, y2))
+                col_max, row_max = getCell(max(x1, x2), max(y1, y2))
+                for row in range(row_min, row_max+1):
+                    for col in range(col_min, col_max+1):
+                        self.boundary.setdefault((col, row), []).append(edge)
+
+    # Verify if the point is inside the polygon, casting a ray to east
+    # and counting the edges it crosses (even-odd rule, so holes work)
+    def rayCast(self, longitude, latitude):
+        inside = False
+        for x1, y1, x2, y2 in self.rows.get(getRow(latitude), []):
+            if (y1 > latitude) != (y2 > latitude):
+                if longitude < x1 + (latitude - y1) * (x2 - x1) / (y2 - y1):
+                    inside = not inside
+        return inside
+
+    # Verify which of the points (NumPy arrays) are inside the
+    # polygon, casting the rays of all points on a row at once
+    def rayCastBatch(self, longitudes, latitudes):
+        inside = numpy.zeros(len(longitudes), dtype=bool)
+        rows = numpy.floor(latitudes / row_size).astype(numpy.int64)
+        for row in numpy.unique(rows):
+            row = int(row)
+            if row not in self.row_arrays:
+                self.row_arrays[row] = numpy.array(self.rows.get(row, []), dtype=float).reshape(-1, 4)
+            edges = self.row_arrays[row]
+            if len(edges) == 0:
+                continue
+            points = numpy.nonzero(rows == row)[0]
+            x1, y1, x2, y2 = edges[:, 0], edges[:, 1], edges[:, 2], edges[:, 3]
+            step = max(1, max_batch_pairs // len(edges))
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                for start in range(0, len(points), step):
+                    chunk = points[start:start+step]
+                    x = longitudes[chunk, None]
+                    y = latitudes[chunk, None]
+                    crosses = ((y1 > y) != (y2 > y)) & (x < x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+                    inside[chunk] = crosses.sum(axis=1) % 2 == 1
+        return inside
+
+    # Verify if the point is inside the polygon
+    def contains(self, longitude, latitude):
+        if longitude < self.bbox[0] or longitude > self.bbox[2] or latitude < self.bbox[1] or latitude > self.bbox[3]:
+            return False
+        cell = getCell(longitude, latitude)
+        if cell in self.boundary:
+            return self.rayCast(longitude, latitude)
+        # no edge crosses the cell, so all of it is
+        # on the same side as its center
+        if cell not in self.cells:
+            self.cells[cell] = self.rayCast((cell[0] + 0.5) * cell_size, (cell[1] + 0.5) * cell_size)
+        return self.cells[cell]
+
+    # Get the distance from the point to the edges of the polygon
+    # on the cells within 'max_distance', or None if there are none
+    def getDistance(self, longitude, latitude):
+        distance = None
+        col_min, row_min = getCell(longitude - max_distance, latitude - max_distance)
+        col_max, row_max = getCell(longitude + max_distance, latitude + max_distance)
+        for col in range(col_min, col_max+1):
+            for row in range(row_min, row_max+1):
+                for x1, y1, x2, y2 in self.boundary.get((col, row), []):
+                    d = getSegmentDistance(longitude, latitude, x1, y1, x2, y2)
+                    if distance is None or d < distance:
+                        distance = d
+        return distance
+
+
+# Resolver of the country of a coordinate
+class CountryResolver:
+
+    def __init__(self, geojson_path, names_path=None):
+        self.polygons = []
+        self.grid = dict()
+        self.resolved = 0
+        self.unresolved = 0
+
+        names = dict()
+        if names_path is not None:
+            names = loadCountryNames(names_path)
+
+        with open(geojson_path, 'r') as geojson_file:
+            features = json.load(geojson_file)['features']
+
+        for feature in features:
+            geometry = feature.get('geometry')
+            if geometry is None:
+                continue
+            properties = feature.get('properties', dict())
+            code = getCountryCode(properties)
+            if code == '':
+                continue
+            name = names.get(code, getCountryName(properties))
+            if geometry['type'] == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry['type'] == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            for rings in polygons:
+                self.addPolygon(CountryPolygon(code, name, rings))
+
+    # Add a polygon to the grid cells its bounding box covers
+    def addPolygon(self, polygon):
+        index = len(self.polygons)
+        self.polygons.append(polygon)
+        col_min, row_min = getCell(polygon.bbox[0], polygon.bbox[1])
+        col_max, row_max = getCell(polygon.bbox[2], polygon.bbox[3])
+        for col in range(col_min, col_max+1):
+            for row in range(row_min, row_max+1):
+                self.grid.setdefault((col, row), []).append(index)
+
+    # Get the polygons whose bounding boxes cover the cells around a point
+    def getCandidates(self, longitude, latitude, distance=0):
+        col_min, row_min = getCell(longitude - distance, latitude - distance)
+        col_max, row_max = getCell(longitude + distance, latitude + distance)
+        candidates = set()
+        for col in range(col_min, col_max+1):
+            for row in range(row_min, row_max+1):
+                candidates.update(self.grid.get((col, row), []))
+        return sorted(candidates)
+
+    # Get the code and name of the country of a coordinate. Returns
+    # empty strings if the point is not in or close to any country
+    def resolve(self, longitude, latitude):
+        for index in self.getCandidates(longitude, latitude):
+            polygon = self.polygons[index]
+            if polygon.contains(longitude, latitude):
+                self.resolved += 1
+                return polygon.code, polygon.name
+
+        nearest = None
+        nearest_distance = None
+        for index in self.getCandidates(longitude, latitude, max_distance):
+            distance = self.polygons[index].getDistance(longitude, latitude)
+            if distance is not None and distance <= max_distance and (nearest_distance is None or distance < nearest_distance):
+                nearest = self.polygons[index]
+                nearest_distance = distance
+
+        if nearest is not None:
+            self.resolved += 1
+            return nearest.code, nearest.name
+
+        self.unresolved += 1
+        return '', ''
+
+    # Get the codes and names of the countries of a list of (longitude,
+    # latitude) points, in the same order. Without NumPy the points are
+    # resolved one by one. With more than one worker, the groups of
+    # points are split among a pool of processes
+    def resolveBatch(self, points, workers=1):
+        if len(points) == 0:
+            return []
+
+        if numpy is None:
+            return [self.resolve(float(point[0]), float(point[1])) for point in points]
+
+        if workers > 1 and len(points) > workers and 'fork' in multiprocessing.get_all_start_methods():
+            global pool_resolver
+            pool_resolver = self
+            # sort by cell, so each process gets whole groups of points
+            cells = sorted(range(len(points)), key=lambda i: getCell(float(points[i][0]), float(points[i][1])))
+            size = int(math.ceil(len(points) / float(workers)))
+            chunks = [cells[i:i+size] for i in range(0, len(cells), size)]
+            with multiprocessing.get_context('fork').Pool(len(chunks)) as pool:
+                chunk_results = pool.map(resolveChunk, [[points[i] for i in chunk] for chunk in chunks])
+            results = [None] * len(points)
+            for chunk, chunk_result in zip(chunks, chunk_results):
+                for i, result in zip(chunk, chunk_result):
+                    results[i] = result
+            return results
+
+        coordinates = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        longitudes = coordinates[:, 0]
+        latitudes = coordinates[:, 1]
+        cols = numpy.floor(longitudes / cell_size).astype(numpy.int64)
+        rows = numpy.floor(latitudes / cell_size).astype(numpy.int64)
+        found = numpy.full(len(coordinates), -1, dtype=numpy.int64)
+
+        # group the points by grid cell
+        cells, inverse = numpy.unique(numpy.stack([cols, rows], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = numpy.argsort(inverse, kind='stable')
+        bounds = numpy.searchsorted(inverse[order], numpy.arange(len(cells)+1))
+
+        for c in range(len(cells)):
+            cell = (int(cells[c][0]), int(cells[c][1]))
+            group = order[bounds[c]:bounds[c+1]]
+            for index in self.grid.get(cell, []):
+                polygon = self.polygons[index]
+                group = group[found[group] < 0]
+                if len(group) == 0:
+                    break
+                x = longitudes[group]
+                y = latitudes[group]
+                in_bbox = (x >= polygon.bbox[0]) & (x <= polygon.bbox[2]) & (y >= polygon.bbox[1]) & (y <= polygon.bbox[3])
+                if not in_bbox.any():
+                    continue
+                if cell in polygon.boundary:
+                    inside = in_bbox.copy()
+                    inside[in_bbox] = polygon.rayCastBatch(x[in_bbox], y[in_bbox])
+                else:
+                    if cell not in polygon.cells:
+                        polygon.cells[cell] = polygon.rayCast((cell[0] + 0.5) * cell_size, (cell[1] + 0.5) * cell_size)
+                    inside = in_bbox if polygon.cells[cell] else numpy.zeros(len(group), dtype=bool)
+                found[group[inside]] = index
+
+        results = []
+        for i in range(len(coordinates)):
+            if found[i] >= 0:
+                self.resolved += 1
+                results.append((self.polygons[found[i]].code, self.polygons[found[i]].name))
+            else:
+                # points outside all polygons go through the nearest country search
+                results.append(self.resolve(float(longitudes[i]), float(latitudes[i])))
+        return results
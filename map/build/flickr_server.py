@@ -0,0 +1,406 @@
+#!/usr/bin/python3
+
+# This script runs a local stand-in for the Flickr REST api, serving the
+# methods used by the map builder from a recorded or synthetic fixture,
+# so runs can be timed and compared without credentials or network.
+# Latency, errors and throttling can be added to the responses. Point
+# the builder to it by setting 'api_endpoint' on config.py to
+# http://<host>:<port>/services/rest/
+#
+# Usage: ./flickr_server.py [--fixture file | --photos n] [options]
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import argparse
+import itertools
+import json
+import math
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Address of the server
+default_host = '127.0.0.1'
+default_port = 8642
+
+# User of the synthetic fixtures
+synthetic_user = {
+    'id': '12345678@N00',
+    'alias': 'standin',
+    'username': 'Stand-in User',
+    'realname': 'Stand-in User',
+    'location': 'Campinas, Brazil'
+}
+
+# Share of the synthetic photos that are geotagged, that
+# are public and that have the tag of photos not mapped
+geotagged_share = 0.7
+public_share = 0.9
+dont_map_share = 0.02
+
+# Number of places the synthetic photos are taken at, and
+# the share of photos taken at the exact same coordinates
+# of a previous photo of the same place. As on real maps,
+# a few places get most photos on a small area (a trip to
+# an island or a town) and the others are few and spread
+n_places = 200
+repeated_share = 0.5
+
+# Photos per page, if the request doesn't say
+default_per_page = 100
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Generate a synthetic fixture of a photostream of 'n_photos' photos,
+# uploaded one per minute up to 'last_upload'. Photos are spread over
+# a number of places, many of them on the same coordinates as others.
+# The share of photos of a place falls with its rank (Zipf), and the
+# places with more photos are spread over smaller areas (in degrees)
+def generatePhotostream(n_photos, seed=0, last_upload=1600000000):
+    rand = random.Random(seed)
+    places = [(rand.uniform(-170, 170), rand.uniform(-55, 70), 0.002 + 0.5 * (i / float(n_places)) ** 2) for i in range(n_places)]
+    place_weights = list(itertools.accumulate(1.0 / (i + 1) for i in range(n_places)))
+    place_coords = [[] for place in places]
+    photos = []
+
+    for i in range(n_photos):
+        photo_id = str(50000000000 + i)
+        secret = '{:010x}'.format(rand.getrandbits(40))
+        date_upload = last_upload - 60 * (n_photos - 1 - i)
+        photo = {
+            'id': photo_id,
+            'owner': synthetic_user['id'],
+            'secret': secret,
+            'server': '65535',
+            'farm': 66,
+            'title': 'Photo {}'.format(i),
+            'ispublic': 1 if rand.random() < public_share else 0,
+            'isfriend': 0,
+            'isfamily': 0,
+            'dateupload': str(date_upload),
+            'lastupdate': str(date_upload + rand.randrange(3600)),
+            'tags': 'dontmap' if rand.random() < dont_map_share else 'travel photo',
+            'url_sq': 'https://live.staticflickr.com/65535/{}_{}_s.jpg'.format(photo_id, secret),
+            'latitude': 0,
+            'longitude': 0,
+            'accuracy': 0,
+            'geo_is_public': 0,
+            'geo_is_contact': 0,
+            'geo_is_friend': 0,
+            'geo_is_family': 0
+        }
+        if photo['ispublic'] == 0:
+            photo['isfriend'] = rand.randrange(2)
+            photo['isfamily'] = rand.randrange(2)
+
+        if rand.random() < geotagged_share:
+            p = rand.choices(range(n_places), cum_weights=place_weights)[0]
+            if len(place_coords[p]) > 0 and rand.random() < repeated_share:
+                longitude, latitude = rand.choice(place_coords[p])
+            else:
+                longitude = round(places[p][0] + rand.gauss(0, places[p][2]), 6)
+                latitude = round(places[p][1] + rand.gauss(0, places[p][2]), 6)
+                place_coords[p].append((longitude, latitude))
+            photo['longitude'] = longitude
+            photo['latitude'] = latitude
+            photo['accuracy'] = 16
+            photo['geo_is_public'] = 1
+
+        photos.append(photo)
+
+    return {
+        'user': synthetic_user,
+        'photos': photos,
+        'photosets': {'72157600000000000': {'title': 'Stand-in Photoset', 'photo_ids': [photo['id'] for photo in photos[::2]]}}
+    }
+
+# Load a fixture, recorded or saved from a synthetic one
+def loadFixture(path):
+    with open(path, 'r') as fixture_file:
+        return json.load(fixture_file)
+
+def saveFixture(path, fixture):
+    with open(path, 'w') as fixture_file:
+        json.dump(fixture, fixture_file)
+
+# Function to get the fields of a photo returned for the requested extras
+def getPhotoFields(photo, extras):
+    fields = dict((key, photo[key]) for key in ['id', 'owner', 'secret', 'server', 'farm', 'title', 'ispublic', 'isfriend', 'isfamily'] if key in photo)
+    extras = [extra.strip() for extra in extras.split(',')]
+    if 'geo' in extras:
+        for key in ['latitude', 'longitude', 'accuracy', 'geo_is_public', 'geo_is_contact', 'geo_is_friend', 'geo_is_family']:
+            fields[key] = photo.get(key, 0)
+    if 'tags' in extras:
+        fields['tags'] = photo.get('tags', '')
+    if 'url_sq' in extras:
+        fields['url_sq'] = photo.get('url_sq', '')
+    if 'date_upload' in extras:
+        fields['dateupload'] = photo.get('dateupload', '0')
+    if 'last_update' in extras:
+        fields['lastupdate'] = photo.get('lastupdate', '0')
+    return fields
+
+# Function to verify if a photo matches an api privacy filter
+def isPrivacyFilter(photo, privacy_filter):
+    privacy = [photo.get('ispublic', 1), photo.get('isfriend', 0), photo.get('isfamily', 0)]
+    filters = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1], [0, 0, 0]]
+    if privacy_filter < 1 or privacy_filter > len(filters):
+        return True
+    return privacy == filters[privacy_filter-1]
+
+# Function to get a page of a list of photos, as the api returns it
+def getPage(photos, params):
+    per_page = int(params.get('per_page', default_per_page))
+    page = max(1, int(params.get('page', 1)))
+    total = len(photos)
+    pages = int(math.ceil(total / float(per_page)))
+    start = (page - 1) * per_page
+    extras = params.get('extras', '')
+    return {
+        'page': page,
+        'pages': pages,
+        'perpage': per_page,
+        'total': total,
+        'photo': [getPhotoFields(photo, extras) for photo in photos[start:start+per_page]]
+    }
+
+
+#===== CLASSES ================================================================#
+
+# Api methods answered from a fixture
+class FlickrStandIn:
+
+    def __init__(self, fixture):
+        self.user = fixture['user']
+        self.photosets = fixture.get('photosets', dict())
+        self.setPhotos(fixture['photos'])
+
+    # Replace the photos of the fixture, as when photos are
+    # uploaded or deleted between runs of the map builder
+    def setPhotos(self, photos):
+        # newest uploads first, as the api returns them
+        self.photos = sorted(photos, key=lambda photo: -int(photo.get('dateupload', 0)))
+        self.photos_index = dict((photo['id'], photo) for photo in self.photos)
+        # photos of each filter, so the pages of a request
+        # don't scan the entire photostream again
+        self.filtered = dict()
+
+    def call(self, method, params):
+        methods = {
+            'flickr.urls.lookupUser': self.lookupUser,
+            'flickr.people.getInfo': self.getInfo,
+            'flickr.people.getPublicPhotos': self.getPublicPhotos,
+            'flickr.people.getPhotos': self.getPhotos,
+            'flickr.photos.search': self.search,
+            'flickr.photosets.getPhotos': self.getPhotosetPhotos,
+            'flickr.photos.recentlyUpdated': self.recentlyUpdated
+        }
+        if method not in methods:
+            return {'stat': 'fail', 'code': 112, 'message': 'Method "{}" not found'.format(method)}
+        if 'user_id' in params and params['user_id'] != self.user['id']:
+            return {'stat': 'fail', 'code': 1, 'message': 'User not found'}
+        response = methods[method](params)
+        response.setdefault('stat', 'ok')
+        return response
+
+    def filterPhotos(self, params, privacy_filter=0):
+        min_upload_date = int(params.get('min_upload_date', 0))
+        has_geo = params.get('has_geo') == '1'
+        key = (min_upload_date, privacy_filter, has_geo)
+        if key not in self.filtered:
+            self.filtered[key] = [photo for photo in self.photos
+                                  if int(photo.get('dateupload', 0)) >= min_upload_date
+                                  and isPrivacyFilter(photo, privacy_filter)
+                                  and (not has_geo or photo.get('accuracy', 0) != 0)]
+        return self.filtered[key]
+
+    def lookupUser(self, params):
+        return {'user': {'id': self.user['id'], 'username': {'_content': self.user['alias']}}}
+
+    def getInfo(self, params):
+        return {'person': {
+            'id': self.user['id'],
+            'nsid': self.user['id'],
+            'iconserver': '0',
+            'iconfarm': 0,
+            'username': {'_content': self.user['username']},
+            'realname': {'_content': self.user['realname']},
+            'location': {'_content': self.user['location']},
+            'photosurl': {'_content': 'https://www.flickr.com/photos/{}/'.format(self.user['alias'])},
+            'photos': {'count': {'_content': len(self.photos)}}
+        }}
+
+    def getPublicPhotos(self, params):
+        return {'photos': getPage(self.filterPhotos(params, 1), params)}
+
+    def getPhotos(self, params):
+        return {'photos': getPage(self.filterPhotos(params, int(params.get('privacy_filter', 0))), params)}
+
+    def search(self, params):
+        return {'photos': getPage(self.filterPhotos(params, int(params.get('privacy_filter', 0))), params)}
+
+    def getPhotosetPhotos(self, params):
+        photoset = self.photosets.get(params.get('photoset_id'))
+        if photoset is None:
+            return {'stat': 'fail', 'code': 1, 'message': 'Photoset not found'}
+        privacy_filter = int(params.get('privacy_filter', 0))
+        photos = [self.photos_index[photo_id] for photo_id in photoset['photo_ids'] if photo_id in self.photos_index]
+        photos = [photo for photo in photos if isPrivacyFilter(photo, privacy_filter)]
+        response = getPage(photos, params)
+        response['id'] = params.get('photoset_id')
+        response['title'] = photoset['title']
+        response['owner'] = self.user['id']
+        return {'photoset': response}
+
+    def recentlyUpdated(self, params):
+        min_date = int(params.get('min_date', 0))
+        photos = [photo for photo in self.photos if int(photo.get('lastupdate', 0)) >= min_date]
+        return {'photos': getPage(photos, params)}
+
+
+# Latency, errors and throttling added to the responses
+class Conditions:
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, requests_per_second=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate = requests_per_second
+        self.tokens = max(1.0, requests_per_second)
+        self.updated = time.monotonic()
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+    # Get the HTTP status to answer a request with, 200 if
+    # there is no error, and how long to wait before it
+    def getResponse(self):
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.rand.uniform(-self.jitter, self.jitter))
+            if self.rate > 0:
+                now = time.monotonic()
+                self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens < 1:
+                    self.throttled += 1
+                    return 429, delay
+                self.tokens -= 1
+            if self.rand.random() < self.error_rate:
+                self.errors += 1
+                return 500, delay
+            return 200, delay
+
+
+# Handler of the requests to the stand-in api
+class StandInHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.answer(dict(parse_qsl(urlsplit(self.path).query)))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        params = dict(parse_qsl(urlsplit(self.path).query))
+        params.update(parse_qsl(self.rfile.read(length).decode('utf-8')))
+        self.answer(params)
+
+    def answer(self, params):
+        status, delay = self.server.conditions.getResponse()
+        if delay > 0:
+            time.sleep(delay)
+
+        if status != 200:
+            body = b''
+        else:
+            response = self.server.standin.call(params.get('method', ''), params)
+            body = json.dumps(response).encode('utf-8')
+            if params.get('nojsoncallback') != '1':
+                body = b'jsonFlickrApi(' + body + b')'
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+# Stand-in api server, to be run on a thread or on its own
+class StandInServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, fixture, conditions=None, host=default_host, port=default_port, verbose=False):
+        super().__init__((host, port), StandInHandler)
+        self.standin = FlickrStandIn(fixture)
+        self.conditions = conditions if conditions is not None else Conditions()
+        self.verbose = verbose
+
+    def getEndpoint(self):
+        return 'http://{}:{}/services/rest/'.format(self.server_address[0], self.server_address[1])
+
+    # Serve on a background thread
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+#===== MAIN CODE ==============================================================#
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Local stand-in for the Flickr api')
+    parser.add_argument('--fixture', help='json fixture to serve')
+    parser.add_argument('--photos', type=int, default=1000, help='photos of the synthetic fixture')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic fixture and of the errors')
+    parser.add_argument('--save', help='save the synthetic fixture to this file and exit')
+    parser.add_argument('--host', default=default_host)
+    parser.add_argument('--port', type=int, default=default_port)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait before each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random variation of the latency, in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with HTTP 500')
+    parser.add_argument('--rate', type=float, default=0.0, help='requests per second before answering with HTTP 429')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    if args.fixture is not None:
+        fixture = loadFixture(args.fixture)
+    else:
+        fixture = generatePhotostream(args.photos, args.seed)
+
+    if args.save is not None:
+        saveFixture(args.save, fixture)
+        print('Saved {} photo(s) to {}'.format(len(fixture['photos']), args.save))
+        raise SystemExit
+
+    conditions = Conditions(args.latency, args.jitter, args.error_rate, args.rate, args.seed)
+    server = StandInServer(fixture, conditions, args.host, args.port, args.verbose)
+    print('Serving {} photo(s) of user \'{}\' on {}'.format(len(fixture['photos']), fixture['user']['alias'], server.getEndpoint()))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('\n{} request(s), {} error(s), {} throttled'.format(conditions.requests, conditions.errors, conditions.throttled))
@@ -8,25 +8,51 @@
 #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 
 import flickrapi
+import asyncio
+import atexit
 import json
 import os
 import sys
 import time
 import math
-import random
 
-from matrix import matrix_dict
-from coords import coords_dict
-from countries_info import getCountryInfo
-from countries_config import update_matrix
+from markers import addPhoto, mergeMarkers, clusterMarkers, removePhotos, indexPhotos, orderMarkers
+from pages import fetchPages, fetchPagesAsync
+from async_client import FlickrAsyncClient
+from retry import RetryPolicy, RateLimiter
+from checkpoint import startCheckpoint, saveCheckpoint, loadCheckpoint, getCheckpointPhotos, truncateCheckpoint, removeCheckpoint
+from sync import loadSyncState, saveSyncState, getMappedPhotoIds, getNewestUpload, getEditedPhotos
+from countries_polygons import CountryResolver
+from pyramid import buildPyramid, writePyramid
+from shards import hasShards, loadShards, writeShards, removeShards
+from compact import writeCompact, loadCompact
+from artifacts import publishArtifacts, unpublishArtifacts, removeArtifacts
+from geocache import GeocodeCache, QuantizedCache, importCache, loadCache, saveCache, exportCache
+from metrics import Metrics
+from runlog import RunLog
+
+# the online geocoder is only needed when the countries of the
+# markers are not found on the polygons of 'countries_geojson'
+try:
+    from countries_info import getCountryInfo
+    from countries_config import update_matrix
+except ImportError:
+    getCountryInfo = None
+    update_matrix = False
 
 
 # ================= CONFIGURATION VARIABLES =====================
 
 # Limits
 photos_per_page = '500'
-max_number_of_pages = 200
-max_number_of_photos = max_number_of_pages * int(photos_per_page)
+
+# Extra information requested for each photo
+photo_extras = 'geo,tags,url_sq,date_upload'
+
+# Retries
+max_tries = 10
+retry_base_delay = 1.0
+retry_max_delay = 60.0
 
 
 # ===============================================================
@@ -34,13 +60,24 @@ max_number_of_photos = max_number_of_pages * int(photos_per_page)
 # get full script's path
 run_path = os.path.dirname(os.path.realpath(__file__))
 
+# time when the run started
+run_start = int(time.time())
+
+# resume an interrupted run from its checkpoint
+resume = '--resume' in sys.argv[1:]
+
+# process only the photos uploaded since last run
+sync = '--sync' in sys.argv[1:]
+
 # remove fatal file
 if os.path.exists("{}/fatal".format(run_path)):
     os.system("rm {}/fatal".format(run_path))
 
-# open log file
+# open log file. Its records are buffered, so it's
+# closed (and its records written) when the script ends
 try:
-    log_file = open("{}/map.log".format(run_path), "a")
+    log_file = RunLog("{}/map.log".format(run_path))
+    atexit.register(log_file.close)
 except Exception as e:
     print("ERROR: FATAL: Unable to open log file")
     print(str(e))
@@ -50,6 +87,10 @@ except Exception as e:
 # check if there is a config file and import it
 if os.path.exists("{}/config.py".format(run_path)):
     import config
+    log_file.setLevel(getattr(config, 'log_level', 'INFO'))
+    log_file.max_size = getattr(config, 'log_max_size', log_file.max_size)
+    log_file.backups = getattr(config, 'log_backups', log_file.backups)
+    log_file.progress_interval = getattr(config, 'log_progress_interval', log_file.progress_interval)
 else:
     print("ERROR: FATAL: File 'config.py' not found. Create one and try again.")
     log_file.write("ERROR: FATAL: File 'config.py' not found. Create one and try again.")
@@ -69,8 +110,82 @@ else:
 api_key = api_credentials.api_key
 api_secret = api_credentials.api_secret
 
-# Flickr api access
+# Flickr api access. If an endpoint is set on config file, as the
+# one of the local stand-in server, all calls are sent to it
+api_endpoint = getattr(config, 'api_endpoint', '')
+
 flickr = flickrapi.FlickrAPI(api_key, api_secret, format='parsed-json')
+if api_endpoint != '':
+    flickr.REST_URL = api_endpoint
+
+# geocoding caches, on binary files or on Python literal modules.
+# A missing module is an empty cache, as when the countries are
+# found on polygons and the caches were never created
+cache_format = getattr(config, 'cache_format', 'binary')
+
+if cache_format == 'python':
+    matrix_dict = dict()
+    coords_dict = dict()
+    if os.path.exists("{}/matrix.py".format(run_path)):
+        matrix_dict = importCache("{}/matrix.py".format(run_path), 'matrix_dict')
+    if os.path.exists("{}/coords.py".format(run_path)):
+        coords_dict = importCache("{}/coords.py".format(run_path), 'coords_dict')
+else:
+    matrix_cache = loadCache("{}/matrix.bin".format(run_path), "{}/matrix.py".format(run_path), 'matrix_dict')
+    coords_cache = loadCache("{}/coords.bin".format(run_path), "{}/coords.py".format(run_path), 'coords_dict')
+    matrix_dict = matrix_cache
+    coords_dict = coords_cache
+
+# bounded cache of the countries of the coordinates, rounded to
+# 'geocode_precision' degrees. When it's used, the coordinates
+# cache no longer grows with the photos
+geocode_precision = getattr(config, 'geocode_precision', 0)
+
+if geocode_precision > 0:
+    geocode_cache = QuantizedCache(geocode_precision, getattr(config, 'geocode_cache_size', 100000), GeocodeCache("{}/geocode.bin".format(run_path)))
+else:
+    geocode_cache = None
+
+# number of pages fetched at the same time
+fetch_workers = getattr(config, 'fetch_workers', 1)
+
+# request only geotagged photos with flickr.photos.search
+use_search = config.photoset_id == '' and getattr(config, 'fetch_mode', 'photos') == 'search'
+
+# distance, in metres, photos are clustered by on the same marker
+cluster_distance = getattr(config, 'cluster_distance', 0)
+
+# maximum number of pages processed, from the newest one. If
+# it's 0, all photos are processed
+max_number_of_pages = getattr(config, 'max_pages', 0)
+if max_number_of_pages > 0:
+    max_number_of_photos = max_number_of_pages * int(photos_per_page)
+else:
+    max_number_of_photos = math.inf
+
+# asyncio client, sharing a pool of connections among all calls
+use_async_client = getattr(config, 'async_client', False)
+
+# retry policy and requests budget shared by all api calls
+rate_limiter = RateLimiter(getattr(config, 'requests_per_hour', 3600))
+retry_policy = RetryPolicy(max_tries, retry_base_delay, retry_max_delay, rate_limiter)
+
+if use_async_client:
+    # set as the current loop, so the futures gathered on it belong to it
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    # signed as flickrapi signs its calls, with the token of the user
+    if api_endpoint != '':
+        client = FlickrAsyncClient(api_key, endpoint=api_endpoint, pool_size=fetch_workers, oauth_client=flickr.flickr_oauth.oauth.client)
+    else:
+        client = FlickrAsyncClient(api_key, pool_size=fetch_workers, oauth_client=flickr.flickr_oauth.oauth.client)
+
+# time of the phases of the run and latency of the api calls,
+# written to a json file on folder 'metrics_dir' when the run
+# ends, even if it's aborted. No file is written if it's empty
+metrics_dir = getattr(config, 'metrics_dir', '')
+metrics_keep = getattr(config, 'metrics_keep', 30)
+metrics = Metrics(run_start)
 
 
 #===== FUNCTIONS ==============================================================#
@@ -96,6 +211,18 @@ def isGeoTagged(photo):
         return False
     return True
 
+# Function to verify if photo matches the photo privacy filter
+def isPhotoPrivacy(photo):
+    if config.photo_privacy == 0 or 'ispublic' not in photo:
+        return True
+    privacy = [photo['ispublic'], photo['isfriend'], photo['isfamily']]
+    filters = [[1, 0, 0], [0, 1, 0], [0, 0, 1], [0, 1, 1], [0, 0, 0]]
+    return privacy == filters[config.photo_privacy-1]
+
+# Function to verify if photo can be included on the map
+def isMappable(photo):
+    return isGeoTagged(photo) and (config.geo_privacy == 0 or getGeoPrivacy(photo) == config.geo_privacy) and config.dont_map_tag.lower() not in photo['tags']
+
 # Get the number of markers on locations dictionary
 def getNumberOfMarkers(dict):
     n = 0
@@ -111,19 +238,221 @@ def getNumberOfPhotos(dict):
             p += len(marker[1])
     return p
 
-# Update last_total file with the new value
-def updateLastTotalFile(run_path, current_total):
+# Verify if there is a map already, on a single locations
+# file, on a compact file or on one file per country
+def hasMap(run_path):
+    return os.path.exists("{}/locations.py".format(run_path)) or os.path.exists("{}/locations_compact.py".format(run_path)) or hasShards(run_path)
+
+# Load the markers already on map
+def loadLocations(run_path):
     if os.path.exists("{}/locations.py".format(run_path)):
-        os.system("echo \"number = {0}\" > {1}/last_total.py".format(current_total, run_path))
+        from locations import locations_dict
+        return locations_dict
+    if os.path.exists("{}/locations_compact.py".format(run_path)):
+        return loadCompact("{}/locations_compact.py".format(run_path))
+    if hasShards(run_path):
+        return loadShards(run_path)
+    return dict()
+
+# Update last_total file with the new value and the
+# newest upload date of the photos processed so far
+def updateLastTotalFile(run_path, current_total, newest_upload):
+    if hasMap(run_path):
+        os.system("printf \"number = {0}\\nnewest_upload = {1}\\n\" > {2}/last_total.py".format(current_total, newest_upload, run_path))
+
+
+# Get the api method and arguments to request photos according to
+# run mode. Page 0 requests only the total number of photos. If
+# 'min_upload_date' is given, only photos uploaded since then are
+# requested, and 'extras' replaces the default photo extras. On
+# search mode the pages, and any request if 'geo_only' is set,
+# have only geotagged photos, filtered by the api, of all content
+# types (7), as the other methods return
+def getPhotosRequest(mode, user_id, pg=0, min_upload_date=None, extras=None, geo_only=False):
+    if mode == 'photoset':
+        method = 'flickr.photosets.getPhotos'
+        params = dict(user_id=user_id, photoset_id=config.photoset_id, privacy_filter=config.photo_privacy, content_types=0, per_page=photos_per_page)
+    elif geo_only or (use_search and pg > 0):
+        method = 'flickr.photos.search'
+        params = dict(user_id=user_id, has_geo=1, privacy_filter=config.photo_privacy, content_type=7, sort='date-posted-desc', per_page=photos_per_page)
+    elif pg == 0 and min_upload_date is None:
+        method = 'flickr.people.getPublicPhotos'
+        params = dict(user_id=user_id, content_types=0, per_page=photos_per_page)
+    else:
+        method = 'flickr.people.getPhotos'
+        params = dict(user_id=user_id, privacy_filter=config.photo_privacy, content_types=0, per_page=photos_per_page)
+    if min_upload_date is not None:
+        params['min_upload_date'] = min_upload_date
+    if pg > 0:
+        params['extras'] = photo_extras if extras is None else extras
+        params['page'] = pg
+    return method, params
+
+# Report a failed api call that will be tried again
+def reportRetry(e, tries, delay):
+    print("ERROR: {}".format(str(e)))
+    print('Trying again in {0:.1f}s ({1}/{2})...'.format(delay, tries, max_tries))
+    log_file.warning('Trying again', error=str(e), delay=delay, tries=tries, max_tries=max_tries)
+
+# Report a fatal error and finish the script
+def reportFatalError(message, e):
+    print("ERROR: FATAL: {}".format(message))
+    print(str(e))
+    log_file.write("ERROR: FATAL: {}\n".format(message))
+    log_file.write('{}\n'.format(str(e)))
+    os.system("touch {}/fatal".format(run_path))
+    sys.exit()
+
+# Get the function of the api object for an api method
+def getApiFunction(method):
+    function = flickr
+    for name in method.split('.')[1:]:
+        function = getattr(function, name)
+    return function
+
+# Count the bytes of a response of the api, as sent by the server
+def countResponse(response, *args, **kwargs):
+    metrics.addCounter('bytes_received', int(response.headers.get('content-length', len(response.content))))
+
+# Call an api method with the retry policy. Each try is timed
+def callApi(method, **params):
+    function = getApiFunction(method)
+    return retry_policy.call(lambda: metrics.timeCall(method, lambda: function(api_key=api_key, **params)), reportRetry)
+
+# Call an api method with the asyncio client and the retry policy
+async def callApiAsync(method, **params):
+    return await retry_policy.callAsync(lambda: metrics.timeCallAsync(method, lambda: client.call(method, **params)), reportRetry)
+
+# Get photos according to run mode. If the
+# api call fails the script is finished
+def getPhotos(mode, user_id, pg=0, **options):
+    method, params = getPhotosRequest(mode, user_id, pg, **options)
+    try:
+        return callApi(method, **params)
+    except Exception as e:
+        reportFatalError("Unable to get photos", e)
+
+# Get photos according to run mode with the asyncio client
+async def getPhotosAsync(mode, user_id, pg=0, **options):
+    method, params = getPhotosRequest(mode, user_id, pg, **options)
+    try:
+        return await callApiAsync(method, **params)
+    except Exception as e:
+        reportFatalError("Unable to get photos", e)
+
+# Get the list of photos on a page
+def getPageOfPhotos(mode, photos):
+    if mode == 'photoset':
+        return photos['photoset']['photo']
+    return photos['photos']['photo']
+
+# Get the ids of all photos on photostream. On search mode,
+# or if 'geo_only' is set, only the ids of the geotagged photos
+def getPhotoIds(mode, user_id, geo_only=False):
+    photos = getPhotos(mode, user_id, 1, extras='', geo_only=geo_only)
+    photo_ids = set(photo['id'] for photo in getPageOfPhotos(mode, photos))
+    npages = int(photos['photoset' if mode == 'photoset' else 'photos']['pages'])
+    if use_async_client:
+        pages = fetchPagesAsync(loop, lambda pg: getPhotosAsync(mode, user_id, pg, extras='', geo_only=geo_only), npages, fetch_workers, 2)
+    else:
+        pages = fetchPages(lambda pg: getPhotos(mode, user_id, pg, extras='', geo_only=geo_only), npages, fetch_workers, 2)
+    for pg, photos in pages:
+        for photo in getPageOfPhotos(mode, photos):
+            photo_ids.add(photo['id'])
+    return photo_ids
+
+# Get the photos updated since a date. The api requires an
+# authenticated token with read permission for this method
+def getUpdatedPhotos(min_date):
+    updated_photos = []
+    pg = 1
+    npages = 1
+    while pg <= npages:
+        params = dict(min_date=min_date, extras=photo_extras, per_page=photos_per_page, page=pg)
+        if use_async_client:
+            photos = loop.run_until_complete(callApiAsync('flickr.photos.recentlyUpdated', **params))
+        else:
+            photos = callApi('flickr.photos.recentlyUpdated', **params)
+        npages = int(photos['photos']['pages'])
+        updated_photos.extend(photos['photos']['photo'])
+        pg += 1
+    return updated_photos
+
+# Remove the map files, so the entire map is generated again
+def removeMapFiles(run_path):
+    if os.path.exists("{}/locations.py".format(run_path)):
+        os.system("rm {}/locations.py".format(run_path))
+    if os.path.exists("{}/countries.py".format(run_path)):
+        os.system("rm {}/countries.py".format(run_path))
+    if os.path.exists("{}/user.py".format(run_path)):
+        os.system("rm {}/user.py".format(run_path))
+    if os.path.exists("{}/clusters.py".format(run_path)):
+        os.system("rm {}/clusters.py".format(run_path))
+    if os.path.exists("{}/locations_compact.py".format(run_path)):
+        os.system("rm {}/locations_compact.py".format(run_path))
+    removeShards(run_path)
+    removeArtifacts(run_path)
+
+# Write the metrics of the run, with the retries, the time waited
+# for the requests budget and the bytes received from the api
+def writeMetrics():
+    metrics.setCounter('retries', retry_policy.retries)
+    metrics.setCounter('rate_limit_wait', round(rate_limiter.waited, 4))
+    if use_async_client:
+        metrics.addCounter('bytes_received', client.bytes_received)
+        metrics.setCounter('connections_opened', client.connections_opened)
+    try:
+        metrics.write(os.path.join(run_path, metrics_dir), metrics_keep)
+    except Exception as e:
+        print("ERROR: Unable to write metrics")
+        print(str(e))
+        log_file.write("ERROR: Unable to write metrics\n")
+        log_file.write('{}\n'.format(str(e)))
+
+# Write the summary of the run to the log. The run is fatal if
+# a fatal error was logged, and aborted if it didn't finish
+def writeSummary():
+    if log_file.counts['CRITICAL'] > 0:
+        status = 'fatal'
+    elif run_finished:
+        status = 'finished'
+    else:
+        status = 'aborted'
+    fields = dict(metrics.counters)
+    fields['retries'] = retry_policy.retries
+    fields['duration'] = round(time.time() - run_start, 1)
+    log_file.summary(status, **fields)
 
 
 #===== MAIN CODE ==============================================================#
 
+log_file.info('Run started', args=' '.join(sys.argv[1:]))
+
+# the summary of the run and its metrics are written when it ends
+run_finished = False
+atexit.register(writeSummary)
+
+if metrics_dir != '':
+    atexit.register(writeMetrics)
+
+# the bytes of the responses of flickrapi are counted as they come
+flickr.flickr_oauth.session.hooks['response'].append(countResponse)
+
 user_alias = config.user
 
+# set script mode (photoset or photostream)
+if config.photoset_id != '':
+    mode = 'photoset'
+else:
+    mode = 'photostream'
+
 # get user id from user url on config file
 try:
-    user_id = flickr.urls.lookupUser(api_key=api_key, url='flickr.com/people/{}'.format(user_alias))['user']['id']
+    with metrics.phase('user_lookup'):
+        if use_async_client:
+            user_id = loop.run_until_complete(callApiAsync('flickr.urls.lookupUser', url='flickr.com/people/{}'.format(user_alias)))['user']['id']
+        else:
+            user_id = callApi('flickr.urls.lookupUser', url='flickr.com/people/{}'.format(user_alias))['user']['id']
 except Exception as e:
     print("ERROR: FATAL: Unable to get user id")
     print(str(e))
@@ -132,9 +461,18 @@ except Exception as e:
     os.system("touch {}/fatal".format(run_path))
     sys.exit()
 
-# get user info
+# get user info. The asyncio client also gets the
+# total number of photos at the same time
+photos = None
+
 try:
-    user_info = flickr.people.getInfo(api_key=api_key, user_id=user_id)
+    with metrics.phase('user_info'):
+        if use_async_client:
+            user_info, photos = loop.run_until_complete(asyncio.gather(
+                callApiAsync('flickr.people.getInfo', user_id=user_id),
+                getPhotosAsync(mode, user_id)))
+        else:
+            user_info = callApi('flickr.people.getInfo', user_id=user_id)
 except Exception as e:
     print("ERROR: FATAL: Unable to get user info")
     print(str(e))
@@ -192,87 +530,173 @@ except:
 # stores the coordinates fo the markers
 coords = []
 
-# set script mode (photoset or photostream)
-if config.photoset_id != '':
-    mode = 'photoset'
-else:
-    mode = 'photostream'
+# index of the markers by their coordinates
+markers_index = dict()
 
 # get the total number of photos
-max_tries = 10
-
-for tries in range(1, max_tries+1):
-    try:
-        if mode == 'photoset':
-            photos = flickr.photosets.getPhotos(api_key=api_key, user_id=user_id, photoset_id=config.photoset_id, privacy_filter=config.photo_privacy, content_types=0, per_page=photos_per_page)
-            npages = int(photos['photoset']['pages'])
-            total = int(photos['photoset']['total'])
-            print('Generating map for \'{}\''.format(user_name))
-            print('Photoset \'{}\''.format(photos['photoset']['title']))
-            print('{} photos in the photoset'.format(total))
-            log_file.write('Generating map for \'{}\'\n'.format(user_name))
-            log_file.write('Photoset \'{}\'\n'.format(photos['photoset']['title']))
-            log_file.write('{} photos in the photoset\n'.format(total))
-        else:
-            photos = flickr.people.getPublicPhotos(api_key=api_key, user_id=user_id, content_types=0, per_page=photos_per_page)
-            npages = int(photos['photos']['pages'])
-            total = int(photos['photos']['total'])
-            print('Generating map for \'{}\''.format(user_name))
-            print('{} photos in the photostream'.format(total))
-            log_file.write('Generating map for \'{}\'\n'.format(user_name))
-            log_file.write('{} photos in the photostream\n'.format(total))
-        break
-    except Exception as e:
-        if tries < max_tries:
-            print("ERROR: Unable to get photos")
-            print(str(e))
-            print('Trying again...')
-            log_file.write("ERROR: Unable to get photos\n")
-            log_file.write('{}\n'.format(str(e)))
-            log_file.write('Trying again...\n')
-        else:
-            print("ERROR: FATAL: Unable to get photos after {}".format(max_tries))
-            print(str(e))
-            log_file.write("ERROR: FATAL: Unable to get photos after {} tries\n".format(max_tries))
-            log_file.write('{}\n'.format(str(e)))
-            os.system("touch {}/fatal".format(run_path))
-            sys.exit()
+if photos is None:
+    with metrics.phase('count'):
+        photos = getPhotos(mode, user_id)
+
+if mode == 'photoset':
+    npages = int(photos['photoset']['pages'])
+    total = int(photos['photoset']['total'])
+    print('Generating map for \'{}\''.format(user_name))
+    print('Photoset \'{}\''.format(photos['photoset']['title']))
+    print('{} photos in the photoset'.format(total))
+    log_file.write('Generating map for \'{}\'\n'.format(user_name))
+    log_file.write('Photoset \'{}\'\n'.format(photos['photoset']['title']))
+    log_file.write('{} photos in the photoset\n'.format(total))
+else:
+    npages = int(photos['photos']['pages'])
+    total = int(photos['photos']['total'])
+    print('Generating map for \'{}\''.format(user_name))
+    print('{} photos in the photostream'.format(total))
+    log_file.write('Generating map for \'{}\'\n'.format(user_name))
+    log_file.write('{} photos in the photostream\n'.format(total))
 
 # current number of photos on photostream
 current_total = total
 
-# difference on number of photos from previous run
-delta_total = int(total)
+# state of the incremental sync
+sync_path = "{}/sync.json".format(run_path)
+sync_state = None
+
+# only photos uploaded after this date are processed
+min_upload_date = None
+
+# newest upload date of the photos processed
+newest_upload = 0
+
+# photos deleted from photostream that are still on map
+deleted_ids = set()
+
+# photos whose location on map was edited since last run
+edited_ids = set()
+edited_photos = []
+
+# markers already on map, loaded when they're first needed
+locations_dict = None
+
+# start of the period checked for edited photos on next run
+last_run = run_start
+
+if sync:
+    if mode == 'photostream' and hasMap(run_path):
+        sync_state = loadSyncState(sync_path, user_id)
+    if sync_state is None:
+        print('No sync state found. The entire photostream will be processed')
+        log_file.write('No sync state found. The entire photostream will be processed\n')
 
-# if there is no difference, finish script
-if os.path.exists("{}/last_total.py".format(run_path)):
-    import last_total
-    delta_total = int(current_total) - int(last_total.number)
-    if delta_total == 0:
-        print('No changes on number of photos since last run.\nAborted.')
-        log_file.write('No changes on number of photos since last run.\nAborted.\n')
+if sync_state is not None:
+
+    newest_upload = sync_state['newest_upload']
+
+    # get the number of photos uploaded since last run
+    with metrics.phase('count'):
+        total = int(getPhotos(mode, user_id, min_upload_date=newest_upload+1)['photos']['total'])
+
+    # if there are less photos than expected, some were deleted,
+    # so compare the ids on map with the ones on photostream
+    if current_total < sync_state['total'] + total:
+        with metrics.phase('photo_ids'):
+            deleted_ids = sync_state['photo_ids'] - getPhotoIds(mode, user_id)
+
+    # get the photos edited since last run, moving only
+    # the ones whose location on map has changed
+    if sync_state.get('last_run') is not None:
+        try:
+            with metrics.phase('load_map'):
+                locations_dict = loadLocations(run_path)
+            with metrics.phase('updated_photos'):
+                updated_photos = getUpdatedPhotos(sync_state['last_run'])
+            edited_ids, edited_photos = getEditedPhotos(updated_photos, indexPhotos(locations_dict), newest_upload, lambda photo: isMappable(photo) and isPhotoPrivacy(photo), cluster_distance)
+        except Exception as e:
+            last_run = sync_state['last_run']
+            print("ERROR: Unable to get recently updated photos")
+            print(str(e))
+            log_file.write("ERROR: Unable to get recently updated photos\n")
+            log_file.write('{}\n'.format(str(e)))
+
+    n_edited = len(edited_ids | set(photo['id'] for photo in edited_photos))
+    if n_edited > 0:
+        print('{} photo(s) edited since last run will be moved on map'.format(n_edited))
+        log_file.write('{} photo(s) edited since last run will be moved on map\n'.format(n_edited))
+
+    if total == 0 and len(deleted_ids) == 0 and n_edited == 0:
+        saveSyncState(sync_path, user_id, current_total, newest_upload, sync_state['photo_ids'], last_run)
+        print('No changes on photos since last run.\nAborted.')
+        log_file.write('No changes on photos since last run.\nAborted.\n')
         sys.exit()
 
-# if difference > 0, makes total = delta_total
-# to process only the new photos, otherwise
-# (photos were deleted), run in all
-# photostream to update the entire map
-if mode == 'photostream':
-    if delta_total > 0:
-        if total != delta_total:
-            total = delta_total
-            print('{} new photo(s) added'.format(total))
-            log_file.write('{} new photo(s) added\n'.format(total))
-    else:
-        n_deleted = abs(delta_total)
-        if os.path.exists("{}/locations.py".format(run_path)):
-            os.system("rm {}/locations.py".format(run_path))
-        if os.path.exists("{}/countries.py".format(run_path)):
-            os.system("rm {}/countries.py".format(run_path))
-        if os.path.exists("{}/user.py".format(run_path)):
-            os.system("rm {}/user.py".format(run_path))
-        print('{} photo(s) deleted from photostream.\nThe corresponding markers will also be deleted'.format(n_deleted))
-        log_file.write('{} photo(s) deleted from photostream.\nThe corresponding markers will alse be deleted\n'.format(n_deleted))
+    if len(deleted_ids) > 0:
+        print('{} photo(s) deleted from photostream will be removed from map'.format(len(deleted_ids)))
+        log_file.write('{} photo(s) deleted from photostream will be removed from map\n'.format(len(deleted_ids)))
+
+    min_upload_date = newest_upload + 1
+    print('{} new photo(s) uploaded since last run'.format(total))
+    log_file.write('{} new photo(s) uploaded since last run\n'.format(total))
+
+else:
+
+    # difference on number of photos from previous run
+    delta_total = int(total)
+
+    # if there is no difference, finish script
+    if os.path.exists("{}/last_total.py".format(run_path)):
+        import last_total
+        delta_total = int(current_total) - int(last_total.number)
+        newest_upload = getattr(last_total, 'newest_upload', 0)
+        if delta_total == 0:
+            print('No changes on number of photos since last run.\nAborted.')
+            log_file.write('No changes on number of photos since last run.\nAborted.\n')
+            sys.exit()
+
+    # if difference > 0, makes total = delta_total
+    # to process only the new photos, otherwise
+    # (photos were deleted), find the deleted photos
+    # that are on map by comparing ids and remove
+    # them, or run in all photostream to update
+    # the entire map if there is no map yet
+    if mode == 'photostream':
+        if delta_total > 0:
+            if total != delta_total:
+                total = delta_total
+                print('{} new photo(s) added'.format(total))
+                log_file.write('{} new photo(s) added\n'.format(total))
+        elif hasMap(run_path):
+            with metrics.phase('load_map'):
+                locations_dict = loadLocations(run_path)
+            # only geotagged photos can be on map, so only
+            # their ids are compared with the ones on map
+            with metrics.phase('photo_ids'):
+                deleted_ids = getMappedPhotoIds(locations_dict) - getPhotoIds(mode, user_id, geo_only=True)
+
+            print('{} photo(s) deleted from photostream.\n{} of them will be removed from map'.format(abs(delta_total), len(deleted_ids)))
+            log_file.write('{} photo(s) deleted from photostream.\n{} of them will be removed from map\n'.format(abs(delta_total), len(deleted_ids)))
+
+            # photos may have been added along with the deleted
+            # ones, so the photos uploaded after the newest one
+            # processed on last run are processed, as on sync.
+            # Maps without that date are processed entirely, and
+            # the photos already on them are not added twice
+            if newest_upload > 0:
+                with metrics.phase('count'):
+                    total = int(getPhotos(mode, user_id, min_upload_date=newest_upload+1)['photos']['total'])
+                min_upload_date = newest_upload + 1
+                print('{} new photo(s) uploaded since last run'.format(total))
+                log_file.write('{} new photo(s) uploaded since last run\n'.format(total))
+
+            if total == 0 and len(deleted_ids) == 0:
+                updateLastTotalFile(run_path, current_total, newest_upload)
+                print('No changes on map.\nAborted.')
+                log_file.write('No changes on map.\nAborted.\n')
+                sys.exit()
+        else:
+            n_deleted = abs(delta_total)
+            removeMapFiles(run_path)
+            print('{} photo(s) deleted from photostream.\nThe corresponding markers will also be deleted'.format(n_deleted))
+            log_file.write('{} photo(s) deleted from photostream.\nThe corresponding markers will alse be deleted\n'.format(n_deleted))
 
 
 print('Extracting photo coordinates and ids...')
@@ -281,12 +705,20 @@ log_file.write('Extracting photo coordinates and ids...\n')
 # get number of pages to be processed
 npages = math.ceil(total/int(photos_per_page))
 
+# on search mode, request only the pages with geotagged photos
+if use_search and npages > 0:
+    with metrics.phase('count'):
+        geo_total = int(getPhotos(mode, user_id, min_upload_date=min_upload_date, geo_only=True)['photos']['total'])
+    npages = min(npages, math.ceil(geo_total/int(photos_per_page)))
+    print('{} geotagged photo(s) in {} page(s)'.format(geo_total, npages))
+    log_file.write('{} geotagged photo(s) in {} page(s)\n'.format(geo_total, npages))
+
 # to be included on map
 n_photos = 0  # counts number of photos
 n_markers = 0 # counts number of markers
 
 # extracts only the photos below a number limit
-if npages > max_number_of_pages:
+if max_number_of_pages > 0 and npages > max_number_of_pages:
     npages = max_number_of_pages
     total = max_number_of_pages * int(photos_per_page);
     print("Extracting for the last {} photos".format(total))
@@ -295,76 +727,107 @@ if npages > max_number_of_pages:
 # counts the number of processed photos
 proc_photos = 0
 
-# process each page
-max_tries = 10
+# first page to be processed
+first_pg = 1
+
+# checkpoint of the pages processed, to resume the run if it's interrupted
+checkpoint_path = "{}/checkpoint.jsonl".format(run_path)
+run_info = {'mode': mode, 'user_id': user_id, 'photoset_id': config.photoset_id, 'current_total': current_total, 'total': total, 'npages': npages, 'min_upload_date': min_upload_date}
+
+checkpoint = None
+if resume:
+    checkpoint = loadCheckpoint(checkpoint_path)
+    if checkpoint is None:
+        print('No checkpoint found. Starting from first page')
+        log_file.write('No checkpoint found. Starting from first page\n')
+    elif checkpoint[0] != run_info:
+        print('Photos changed since checkpoint was saved. Starting from first page')
+        log_file.write('Photos changed since checkpoint was saved. Starting from first page\n')
+        checkpoint = None
+
+if checkpoint is not None:
+    last_pg = checkpoint[1]
+    counters = checkpoint[2]
+    checkpoint_size = checkpoint[3]
+
+    # add the photos of the pages already processed
+    for photo in getCheckpointPhotos(checkpoint_path, checkpoint_size):
+        addPhoto(markers_index, coords, photo[0], photo[1], photo[2], photo[3])
+
+    n_photos = counters.get('n_photos', 0)
+    n_markers = counters.get('n_markers', 0)
+    proc_photos = counters.get('proc_photos', 0)
+    # newest upload date of the pages already processed
+    newest_upload = max(newest_upload, counters.get('newest_upload', 0))
+    first_pg = last_pg + 1
+
+    # skip the remaining pages if any limit was already reached
+    if n_photos >= total or n_photos >= max_number_of_photos:
+        first_pg = npages + 1
+
+    print('Resuming from page {0} | {1} photo(s) in {2} marker(s)'.format(first_pg, n_photos, n_markers))
+    log_file.write('Resuming from page {0} | {1} photo(s) in {2} marker(s)\n'.format(first_pg, n_photos, n_markers))
+
+    # keep the pages already processed and append the next ones
+    truncateCheckpoint(checkpoint_path, checkpoint_size)
+else:
+    startCheckpoint(checkpoint_path, run_info)
 
-for pg in range(1, npages+1):
+# pages of photos, fetched in page order
+if use_async_client:
+    pages = fetchPagesAsync(loop, lambda pg: getPhotosAsync(mode, user_id, pg, min_upload_date=min_upload_date), npages, fetch_workers, first_pg)
+else:
+    pages = fetchPages(lambda pg: getPhotos(mode, user_id, pg, min_upload_date=min_upload_date), npages, fetch_workers, first_pg)
 
-    # get photos according to run mode
-    for tries in range(1, max_tries+1):
-        try:
-            if mode == 'photoset':
-                page = flickr.photosets.getPhotos(api_key=api_key, user_id=user_id, photoset_id=config.photoset_id, privacy_filter=config.photo_privacy, content_types=0, extras='geo,tags,url_sq', page=pg, per_page=photos_per_page)['photoset']['photo']
-            else:
-                page = flickr.people.getPhotos(api_key=api_key, user_id=user_id, privacy_filter=config.photo_privacy, content_types=0, extras='geo,tags,url_sq', page=pg, per_page=photos_per_page)['photos']['photo']
-            break
-        except Exception as e:
-            if tries < max_tries:
-                print("ERROR: Unable to get photos")
-                print(str(e))
-                print('Trying again...')
-                log_file.write("ERROR: Unable to get photos\n")
-                log_file.write('{}\n'.format(str(e)))
-                log_file.write('Trying again...\n')
-            else:
-                print("ERROR: FATAL: Unable to get photos after {} tries".format(max_tries))
-                print(str(e))
-                log_file.write("ERROR: FATAL: Unable to get photos after {} tries\n".format(max_tries))
-                log_file.write('{}\n'.format(str(e)))
-                os.system("touch {}/fatal".format(run_path))
-                sys.exit()
+# time waiting for each page
+pages = metrics.timeItems('fetch', pages)
 
+# process each page
+for pg, photos in pages:
+
+    page = getPageOfPhotos(mode, photos)
     photos_in_page = len(page)
 
-    # process each photo on page
-    for ph in range(0, photos_in_page):
+    # photos added to the map by this page
+    page_photos = []
 
-        photo = page[ph]
+    # keep the newest upload date for the next sync
+    newest_upload = getNewestUpload(page, newest_upload)
+
+    # process each photo on page
+    with metrics.phase('filter'):
+        for ph in range(0, photos_in_page):
 
-        # variable to store information if already exist a marker
-        # on the same photo's coordinates
-        marker_exists = False
+            photo = page[ph]
 
-        # check if photo can be included on the map (according to privacy settings)
-        if isGeoTagged(photo) and (config.geo_privacy == 0 or getGeoPrivacy(photo) == config.geo_privacy) and config.dont_map_tag.lower() not in photo['tags']:
+            # check if photo can be included on the map (according to privacy settings)
+            if isMappable(photo):
 
-            n_photos += 1
+                n_photos += 1
 
-            # get coordinates from photo
-            longitude = float(photo['longitude'])
-            latitude = float(photo['latitude'])
+                # get coordinates from photo
+                longitude = float(photo['longitude'])
+                latitude = float(photo['latitude'])
 
-            # read each markers coordinates and append photo in case
-            # there is already a marker on the same coordinate
-            for coord in coords:
-                if longitude == coord[0][0] and latitude == coord[0][1]:
-                    coord[1].append([photo['id'], photo['url_sq']])
-                    marker_exists = True
-                    break
+                # append photo to the marker on the same coordinate
+                # or create a new marker to be added to the map
+                if addPhoto(markers_index, coords, longitude, latitude, photo['id'], photo['url_sq']):
+                    n_markers += 1
 
-            # create a new marker to be added to the map
-            if not marker_exists:
-                coords.append([[longitude, latitude], [[photo['id'], photo['url_sq']]]])
-                n_markers += 1
+                page_photos.append([longitude, latitude, photo['id'], photo['url_sq']])
 
-        proc_photos += 1
+            proc_photos += 1
 
-        # stop processing photos if any limit was reached
-        if proc_photos >= total or proc_photos >= max_number_of_photos:
-           break
+            # stop processing photos if any limit was reached
+            if proc_photos >= total or proc_photos >= max_number_of_photos:
+               break
 
     print('Batch {0}/{1} | {2} photo(s) in {3} marker(s)'.format(pg, npages, n_photos, n_markers), end='\r')
-    log_file.write('Batch {0}/{1} | {2} photo(s) in {3} marker(s)\n'.format(pg, npages, n_photos, n_markers))
+    log_file.progress('Batch {0}/{1}'.format(pg, npages), photos=n_photos, markers=n_markers)
+
+    # save the page on checkpoint
+    with metrics.phase('checkpoint'):
+        saveCheckpoint(checkpoint_path, pg, {'n_photos': n_photos, 'n_markers': n_markers, 'proc_photos': proc_photos, 'newest_upload': newest_upload}, page_photos)
 
     # stop processing pages if any limit was reached
     if n_photos >= total:
@@ -374,15 +837,28 @@ for pg in range(1, npages+1):
         log_file.write("Maximum number of photos on map reached!")
         break
 
+pages.close()
+
+metrics.setCounter('pages', npages)
+metrics.setCounter('processed_photos', proc_photos)
+
+# add the edited photos on their new locations
+for photo in edited_photos:
+    n_photos += 1
+    if addPhoto(markers_index, coords, float(photo['longitude']), float(photo['latitude']), photo['id'], photo['url_sq']):
+        n_markers += 1
+
+if use_async_client:
+    loop.run_until_complete(client.close())
+    loop.close()
+
 print('\nAdding marker(s) to map...')
 log_file.write('Adding marker(s) to map...\n')
 
-# check if there is a file with the markers on map already
-# and import it otherwise created a new variable
-if os.path.exists("{}/locations.py".format(run_path)):
-    from locations import locations_dict
-else:
-    locations_dict = dict()
+# load the markers already on map, if there are any
+if locations_dict is None:
+    with metrics.phase('load_map'):
+        locations_dict = loadLocations(run_path)
 
 # get the number of markers (locations) already on map
 n_markers = getNumberOfMarkers(locations_dict)
@@ -397,47 +873,24 @@ else:
     countries_dict = dict()
 
 
-# counts the number of new photos added to markers
-new_photos = 0
-
-# iterate on each country
-for country in locations_dict:
-
-    # get markers for country
-    country_markers = locations_dict[country]
-
-    # iterate on each marker
-    for marker in country_markers:
-
-        # get info for photos on marker
-        photos_info = marker[1]
-        #n_photos = len(photos_info)
-
-        # get number of photos (coordinates) to be added to map
-        n_coords = len(coords)
-
-        # iterate over each coordinate
-        for coord in range(n_coords-1, -1, -1):
-
-            # if there is already a marker on the same coordinate
-            if coords[coord][0] == marker[0]:
-
-                # read each photo already on the marker
-                for photo in coords[coord][1]:
-                    photo_id = photo[0]
-                    thumb_url = photo[1]
-
-                    # if the photo is not already on marker, add the photo to it
-                    if [photo_id, thumb_url] not in photos_info:
-                        photos_info.append([photo_id, thumb_url])
-                        new_photos += 1
-
-                # remove photo info from
-                # coordinates to be added
-                coords.pop(coord)
-
-        # update the number of photos on marker
-        marker[1] = photos_info
+# remove the photos deleted from photostream and the
+# edited ones from the markers they were before
+if len(deleted_ids) > 0 or len(edited_ids) > 0:
+    with metrics.phase('remove_photos'):
+        removed_photos, removed_markers = removePhotos(locations_dict, countries_dict, deleted_ids | edited_ids)
+    print('Removed {} photo(s) and {} marker(s) from map'.format(removed_photos, removed_markers))
+    log_file.write('Removed {} photo(s) and {} marker(s) from map\n'.format(removed_photos, removed_markers))
+
+# add photos to the markers already on map and keep
+# the coordinates that still need a new marker
+with metrics.phase('merge'):
+    if cluster_distance > 0:
+        n_extracted = len(coords)
+        new_photos, coords = clusterMarkers(locations_dict, coords, cluster_distance)
+        print('Clustered {0} location(s) within {1}m'.format(n_extracted, cluster_distance))
+        log_file.write('Clustered {0} location(s) within {1}m\n'.format(n_extracted, cluster_distance))
+    else:
+        new_photos, coords = mergeMarkers(locations_dict, coords)
 
 if new_photos > 0:
     print('Added {} new photo(s) to existing markers'.format(new_photos))
@@ -455,6 +908,32 @@ if n_markers > 0:
 
 new_markers = 0
 
+# offline resolver of the countries of the markers, using the
+# Natural Earth polygons instead of the geocoding caches
+country_resolver = None
+countries_geojson = getattr(config, 'countries_geojson', '')
+
+if n_markers > 0 and countries_geojson != '':
+    try:
+        with metrics.phase('load_polygons'):
+            country_resolver = CountryResolver(os.path.join(run_path, countries_geojson), "{}/../countries_bbox.js".format(run_path))
+    except Exception as e:
+        print("ERROR: Unable to load countries polygons. Using geocoding instead")
+        print(str(e))
+        log_file.write("ERROR: Unable to load countries polygons. Using geocoding instead\n")
+        log_file.write('{}\n'.format(str(e)))
+
+if n_markers > 0 and country_resolver is None and getCountryInfo is None:
+    print("ERROR: FATAL: Module 'countries_info' not found. Install it or set 'countries_geojson' on config file.")
+    log_file.write("ERROR: FATAL: Module 'countries_info' not found. Install it or set 'countries_geojson' on config file.\n")
+    os.system("touch {}/fatal".format(run_path))
+    sys.exit()
+
+# resolve the countries of all new markers at once
+if country_resolver is not None:
+    with metrics.phase('resolve_countries'):
+        countries_info = country_resolver.resolveBatch([marker_info[0] for marker_info in coords], getattr(config, 'resolver_workers', 1))
+
 # iterate over each marker to be added
 for marker_info in coords:
 
@@ -465,12 +944,22 @@ for marker_info in coords:
     latitude = float(marker_info[0][1])
 
     # get country code and name
-    country_info = getCountryInfo(latitude, longitude, matrix_dict, coords_dict)
-    country_code = country_info[0]
-    country_name = country_info[1]
-    if update_matrix:
-        matrix_dict = country_info[2]
-    coords_dict = country_info[3]
+    if country_resolver is not None:
+        country_code, country_name = countries_info[new_markers-1]
+    else:
+        country_info = None
+        if geocode_cache is not None:
+            country_info = geocode_cache.get(latitude, longitude)
+        if country_info is None:
+            with metrics.phase('getCountryInfo'):
+                country_info = getCountryInfo(latitude, longitude, matrix_dict, coords_dict)
+            if update_matrix:
+                matrix_dict = country_info[2]
+            coords_dict = country_info[3]
+            if geocode_cache is not None:
+                geocode_cache.put(latitude, longitude, [country_info[0], country_info[1]])
+        country_code = country_info[0]
+        country_name = country_info[1]
 
     # add country to countries dictionary
     if country_code != '' and country_code != '*':
@@ -487,7 +976,7 @@ for marker_info in coords:
         locations_dict[country_code].append(marker_info)
 
     print('Added marker {0}/{1}'.format(new_markers, n_markers), end='\r')
-    log_file.write('Added marker {0}/{1}\n'.format(new_markers, n_markers))
+    log_file.progress('Added marker {0}/{1}'.format(new_markers, n_markers))
 
 # finish script
 if new_markers > 0:
@@ -496,110 +985,151 @@ else:
     print('No new markers were added to the map')
     log_file.write('No new markers were added to the map\n')
 
+metrics.setCounter('new_markers', new_markers)
+
+if geocode_cache is not None and geocode_cache.hits + geocode_cache.misses > 0:
+    print('Geocoding cache: {0} hit(s), {1} miss(es), {2} eviction(s)'.format(geocode_cache.hits, geocode_cache.misses, geocode_cache.evictions))
+    log_file.write('Geocoding cache: {0} hit(s), {1} miss(es), {2} eviction(s)\n'.format(geocode_cache.hits, geocode_cache.misses, geocode_cache.evictions))
+
 print('Finished!')
 log_file.write('Finished!\n')
 
 # write countries dictionary to file
-countries_file = open("{}/countries.py".format(run_path), 'w')
-countries_file.write("countries_dict = {\n")
-
-i = 0
-for code in countries_dict:
-    markers = locations_dict[code]
-    n_markers = len(markers)
-    n_photos = 0
-    for marker in markers:
-        n_photos += len(marker[1])
-
-    countries_dict[code][1] = n_markers
-    countries_dict[code][2] = n_photos
-
-    if i < len(countries_dict)-1:
-        countries_file.write("  \'{0}\': {1},\n".format(code, countries_dict[code]))
-    else:
-        countries_file.write("  \'{0}\': {1}\n".format(code, countries_dict[code]))
-    i += 1
-
-countries_file.write("}\n")
-countries_file.close()
-
-# write markers information (locations) to file
-locations_file = open("{}/locations.py".format(run_path), 'w')
-locations_file.write("locations_dict = {\n")
-
-i = 1
-for country_code in locations_dict:
-    locations_file.write("  \'{}\': [\n".format(country_code))
-    random.shuffle(locations_dict[country_code])
-    for coord in range(len(locations_dict[country_code])):
-        locations_file.write("    {}".format(locations_dict[country_code][coord]))
-        if coord < len(locations_dict[country_code])-1:
-            locations_file.write(",\n")
-        else:
-            locations_file.write("\n  ]")
-    if i < len(locations_dict):
-        locations_file.write(",\n")
-    else:
-        locations_file.write("\n")
-    i += 1
-
-locations_file.write("}\n")
-locations_file.close()
-
-if update_matrix:
-    # write matrix dictionary to file
-    matrix_file = open("{}/matrix.py".format(run_path), 'w')
-    matrix_file.write("matrix_dict = {\n")
-
-    i = 1
-    for key in matrix_dict:
-        matrix_file.write("  \'{}\': {}".format(key, matrix_dict[key]))
-        if i < len(matrix_dict):
-            matrix_file.write(",\n")
+with metrics.phase('write_countries'):
+    countries_file = open("{}/countries.py".format(run_path), 'w')
+    countries_file.write("countries_dict = {\n")
+
+    i = 0
+    for code in countries_dict:
+        markers = locations_dict[code]
+        n_markers = len(markers)
+        n_photos = 0
+        for marker in markers:
+            n_photos += len(marker[1])
+
+        countries_dict[code][1] = n_markers
+        countries_dict[code][2] = n_photos
+
+        if i < len(countries_dict)-1:
+            countries_file.write("  \'{0}\': {1},\n".format(code, countries_dict[code]))
         else:
-            matrix_file.write("\n")
+            countries_file.write("  \'{0}\': {1}\n".format(code, countries_dict[code]))
         i += 1
 
-    matrix_file.write("}\n")
-    matrix_file.close()
-
-# write coordinates dictionary to file
-coordinates_file = open("{}/coords.py".format(run_path), 'w')
-coordinates_file.write("coords_dict = {\n")
-
-i = 1
-for key in coords_dict:
-    coordinates_file.write("  \'{}\': {}".format(key, coords_dict[key]))
-    if i < len(coords_dict):
-        coordinates_file.write(",\n")
+    countries_file.write("}\n")
+    countries_file.close()
+
+# order the markers of each country so any part
+# of them, from the first one, covers its area
+with metrics.phase('order'):
+    for country_code in locations_dict:
+        locations_dict[country_code] = orderMarkers(locations_dict[country_code])
+
+# write markers information (locations) to one file per
+# country, to a compact file or to a single file
+output_mode = getattr(config, 'output_mode', 'single')
+
+if output_mode != 'single' and os.path.exists("{}/locations.py".format(run_path)):
+    os.system("rm {}/locations.py".format(run_path))
+if output_mode != 'compact' and os.path.exists("{}/locations_compact.py".format(run_path)):
+    os.system("rm {}/locations_compact.py".format(run_path))
+if output_mode != 'shards':
+    removeShards(run_path)
+
+with metrics.phase('write_locations'):
+    if output_mode == 'shards':
+        writeShards(run_path, locations_dict)
+    elif output_mode == 'compact':
+        writeCompact("{}/locations_compact.py".format(run_path), locations_dict)
+    else:
+        locations_file = open("{}/locations.py".format(run_path), 'w')
+        locations_file.write("locations_dict = {\n")
+
+        i = 1
+        for country_code in locations_dict:
+            locations_file.write("  \'{}\': [\n".format(country_code))
+            for coord in range(len(locations_dict[country_code])):
+                locations_file.write("    {}".format(locations_dict[country_code][coord]))
+                if coord < len(locations_dict[country_code])-1:
+                    locations_file.write(",\n")
+                else:
+                    locations_file.write("\n  ]")
+            if i < len(locations_dict):
+                locations_file.write(",\n")
+            else:
+                locations_file.write("\n")
+            i += 1
+
+        locations_file.write("}\n")
+        locations_file.close()
+
+# write the clusters of the markers on each zoom to file
+if getattr(config, 'cluster_pyramid', False):
+    with metrics.phase('write_clusters'):
+        writePyramid("{}/clusters.py".format(run_path), buildPyramid(locations_dict))
+elif os.path.exists("{}/clusters.py".format(run_path)):
+    os.system("rm {}/clusters.py".format(run_path))
+
+# write matrix and coordinates dictionaries to files
+with metrics.phase('write_caches'):
+    if cache_format == 'python':
+        if update_matrix:
+            exportCache("{}/matrix.py".format(run_path), 'matrix_dict', matrix_dict)
+        if geocode_cache is None:
+            exportCache("{}/coords.py".format(run_path), 'coords_dict', coords_dict)
     else:
-        coordinates_file.write("\n")
-    i += 1
+        if update_matrix:
+            saveCache(matrix_cache, matrix_dict)
+        if geocode_cache is None:
+            saveCache(coords_cache, coords_dict)
 
-coordinates_file.write("}\n")
-coordinates_file.close()
+    if geocode_cache is not None:
+        geocode_cache.save()
 
 # get total number of markers and photos to write to user file
 n_markers = getNumberOfMarkers(locations_dict)
 n_photos = getNumberOfPhotos(locations_dict)
 n_countries = len(countries_dict)
 
+metrics.setCounter('markers', n_markers)
+metrics.setCounter('photos', n_photos)
+metrics.setCounter('countries', n_countries)
+
 # write user information to file
 
-user_file = open("{}/user.py".format(run_path), 'w')
-user_file.write("user_info = {\n")
-user_file.write("  \'id\': \'{}\',\n".format(user_id))
-user_file.write("  \'alias\': \'{}\',\n".format(user_alias))
-user_file.write("  \'name\': \'{}\',\n".format(user_name.replace("\'", "\\\'")))
-user_file.write("  \'avatar\': \'{}\',\n".format(user_avatar))
-user_file.write("  \'url\': \'{}\',\n".format(photos_base_url))
-user_file.write("  \'location\': \'{}\',\n".format(user_location))
-user_file.write("  \'countries\': {},\n".format(n_countries))
-user_file.write("  \'markers\': {},\n".format(n_markers))
-user_file.write("  \'photos\': {}\n".format(n_photos))
-user_file.write("}\n")
-user_file.close()
-
-updateLastTotalFile(run_path, current_total)
-
-log_file.close()
+with metrics.phase('write_user'):
+    user_file = open("{}/user.py".format(run_path), 'w')
+    user_file.write("user_info = {\n")
+    user_file.write("  \'id\': \'{}\',\n".format(user_id))
+    user_file.write("  \'alias\': \'{}\',\n".format(user_alias))
+    user_file.write("  \'name\': \'{}\',\n".format(user_name.replace("\'", "\\\'")))
+    user_file.write("  \'avatar\': \'{}\',\n".format(user_avatar))
+    user_file.write("  \'url\': \'{}\',\n".format(photos_base_url))
+    user_file.write("  \'location\': \'{}\',\n".format(user_location))
+    user_file.write("  \'countries\': {},\n".format(n_countries))
+    user_file.write("  \'markers\': {},\n".format(n_markers))
+    user_file.write("  \'photos\': {}\n".format(n_photos))
+    user_file.write("}\n")
+    user_file.close()
+
+# publish the data files with the hash of their content on their
+# names. Otherwise the loader lists them by their own names
+if getattr(config, 'publish_artifacts', False):
+    with metrics.phase('publish_artifacts'):
+        artifacts = publishArtifacts(run_path)
+    print('Published {} data file(s)'.format(len(artifacts)))
+    log_file.write('Published {} data file(s)\n'.format(len(artifacts)))
+else:
+    unpublishArtifacts(run_path)
+
+updateLastTotalFile(run_path, current_total, newest_upload)
+
+# save the state for the next incremental sync
+if sync and mode == 'photostream':
+    with metrics.phase('write_sync_state'):
+        saveSyncState(sync_path, user_id, current_total, newest_upload, getMappedPhotoIds(locations_dict), last_run)
+
+# the run has finished, so the checkpoint is no longer needed
+removeCheckpoint(checkpoint_path)
+
+run_finished = True
@@ -0,0 +1,311 @@
+# This module keeps the geocoding caches (the matrix and coords
+# dictionaries) in a compact binary file instead of a Python literal
+# module. The file is memory-mapped and only the keys are read on
+# load, each value is decoded the first time it's used. Changes are
+# appended to the end of the file, so saving costs only the entries
+# added or changed by the run. A newer record of a key replaces the
+# older ones, which are dropped when the file is compacted
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import ast
+import importlib.util
+import mmap
+import os
+import struct
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# First bytes of a cache file
+file_header = b'GEOCACHE1\n'
+
+# Header of each record: key length and value length
+record_header = struct.Struct('<HI')
+
+# Value length of a record that deletes its key
+deleted_value = 0xFFFFFFFF
+
+# The file is rewritten with the live records only when
+# the replaced ones are more than this share of all records
+max_dead_share = 0.5
+
+# Value of the entries of a QuantizedCache not decoded yet
+not_loaded = object()
+
+
+# ===============================================================
+
+#===== CLASSES ================================================================#
+
+# Dictionary of a geocoding cache stored on a binary file
+class GeocodeCache(MutableMapping):
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = dict() # key -> offset of its value on file
+        self.values = dict()  # values already decoded
+        self.changed = dict() # keys added or changed since last save
+        self.deleted = set()  # keys deleted since last save
+        self.records = 0      # records on file, including replaced ones
+        self.size = len(file_header)
+        self.file = None
+        self.map = None
+        self.load()
+
+    # Map the file and index the offsets of the values. A record
+    # cut in half by an interruption is ignored and overwritten
+    # on next save
+    def load(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= len(file_header):
+            return
+        self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(file_header)] != file_header:
+            self.close()
+            raise ValueError("'{}' is not a geocoding cache file".format(self.path))
+
+        offset = len(file_header)
+        end = len(self.map)
+        while offset + record_header.size <= end:
+            key_len, value_len = record_header.unpack_from(self.map, offset)
+            key_offset = offset + record_header.size
+            value_offset = key_offset + key_len
+            if value_len == deleted_value:
+                next_offset = value_offset
+            else:
+                next_offset = value_offset + value_len
+            if next_offset > end:
+                break
+            key = self.map[key_offset:value_offset].decode('utf-8')
+            # keys are kept in the order they were last written
+            self.offsets.pop(key, None)
+            if value_len != deleted_value:
+                self.offsets[key] = (value_offset, value_len)
+            self.records += 1
+            offset = next_offset
+        self.size = offset
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    # Keys are stored as strings, so they are converted on every access
+    def __getitem__(self, key):
+        key = str(key)
+        if key in self.values:
+            return self.values[key]
+        if key in self.deleted or key not in self.offsets:
+            raise KeyError(key)
+        value_offset, value_len = self.offsets[key]
+        value = ast.literal_eval(self.map[value_offset:value_offset+value_len].decode('utf-8'))
+        self.values[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        key = str(key)
+        self.values[key] = value
+        self.changed[key] = True
+        self.deleted.discard(key)
+
+    def __delitem__(self, key):
+        key = str(key)
+        if key not in self:
+            raise KeyError(key)
+        self.values.pop(key, None)
+        self.changed.pop(key, None)
+        if key in self.offsets:
+            self.deleted.add(key)
+
+    def __contains__(self, key):
+        key = str(key)
+        return key in self.values or (key in self.offsets and key not in self.deleted)
+
+    def __iter__(self):
+        for key in self.offsets:
+            if key not in self.deleted:
+                yield key
+        for key in self.values:
+            if key not in self.offsets:
+                yield key
+
+    def __len__(self):
+        return len(self.offsets) - len(self.deleted) + len([key for key in self.values if key not in self.offsets])
+
+    # Append the keys added, changed and deleted since last save to
+    # the file, or rewrite it if most of its records were replaced
+    def save(self):
+        if len(self.changed) == 0 and len(self.deleted) == 0 and os.path.exists(self.path):
+            return
+
+        replaced = len([key for key in self.changed if key in self.offsets]) + len(self.deleted)
+        dead = self.records - len(self.offsets) + replaced
+        if dead > max_dead_share * (self.records + len(self.changed) + len(self.deleted)):
+            self.compact()
+            return
+
+        records = []
+        for key in self.deleted:
+            records.append(encodeRecord(key, None, True))
+        for key in self.changed:
+            records.append(encodeRecord(key, self.values[key]))
+
+        self.close()
+        mode = 'r+b' if os.path.exists(self.path) else 'w+b'
+        with open(self.path, mode) as cache_file:
+            if mode == 'w+b':
+                cache_file.write(file_header)
+            cache_file.seek(self.size)
+            cache_file.write(b''.join(records))
+            cache_file.truncate()
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+        self.reload()
+
+    # Rewrite the file with only the live records
+    def compact(self):
+        records = [encodeRecord(key, self[key]) for key in self]
+        self.close()
+        with open("{}.tmp".format(self.path), 'wb') as cache_file:
+            cache_file.write(file_header)
+            cache_file.write(b''.join(records))
+            cache_file.flush()
+            os.fsync(cache_file.fileno())
+        os.replace("{}.tmp".format(self.path), self.path)
+        self.reload()
+
+    def reload(self):
+        self.offsets = dict()
+        self.changed = dict()
+        self.deleted = set()
+        self.records = 0
+        self.size = len(file_header)
+        self.load()
+
+
+# Least recently used cache of the countries of the coordinates, keyed
+# on the coordinates rounded to 'precision' degrees, so nearby points
+# share an entry and a lookup. Holds up to 'max_size' entries, kept
+# on the GeocodeCache 'store' between runs. The entries of the store
+# are decoded the first time they are used
+class QuantizedCache:
+
+    def __init__(self, precision, max_size, store=None):
+        self.precision = precision
+        self.max_size = max_size
+        self.store = store
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if store is not None:
+            for key in store:
+                self.entries[key] = not_loaded
+            self.trim()
+
+    def getKey(self, latitude, longitude):
+        return '{},{}'.format(int(round(latitude / self.precision)), int(round(longitude / self.precision)))
+
+    # Get the cached value of the coordinates, or None
+    def get(self, latitude, longitude):
+        key = self.getKey(latitude, longitude)
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        if self.entries[key] is not_loaded:
+            self.entries[key] = self.store[key]
+        return self.entries[key]
+
+    def put(self, latitude, longitude, value):
+        key = self.getKey(latitude, longitude)
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.trim()
+
+    # Evict the least recently used entries over the size cap
+    def trim(self):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # Save the entries to the store. The ones never used are
+    # still the same on it, so only evicted, added and changed
+    # entries are written
+    def save(self):
+        if self.store is None:
+            return
+        for key in list(self.store.keys()):
+            if key not in self.entries:
+                del self.store[key]
+        for key, value in self.entries.items():
+            if value is not not_loaded and (key not in self.store or self.store[key] != value):
+                self.store[key] = value
+        self.store.save()
+
+
+#===== FUNCTIONS ==============================================================#
+
+# Encode a record of the cache file, or a
+# record that deletes the key if 'deleted' is set
+def encodeRecord(key, value, deleted=False):
+    key = key.encode('utf-8')
+    if deleted:
+        return record_header.pack(len(key), deleted_value) + key
+    value = repr(value).encode('utf-8')
+    return record_header.pack(len(key), len(value)) + key + value
+
+# Load a Python literal module and get its dictionary 'name'
+def importCache(module_path, name):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(os.path.basename(module_path))[0], module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return getattr(module, name)
+
+# Load a geocoding cache from its binary file. If there is
+# none yet but there is a Python literal module, its
+# dictionary is converted to the binary file
+def loadCache(path, module_path, name):
+    if not os.path.exists(path) and os.path.exists(module_path):
+        cache = GeocodeCache(path)
+        cache.update(importCache(module_path, name))
+        cache.save()
+        return cache
+    return GeocodeCache(path)
+
+# Save a geocoding cache to its binary file. If 'cache_dict' is not
+# the cache loaded (i.e. a new dictionary was returned for it), only
+# its entries that differ from the ones on file are written
+def saveCache(cache, cache_dict):
+    if cache_dict is not cache:
+        for key in list(cache.keys()):
+            if key not in cache_dict:
+                del cache[key]
+        for key in cache_dict:
+            if key not in cache or cache[key] != cache_dict[key]:
+                cache[key] = cache_dict[key]
+    cache.save()
+
+# Write a geocoding cache as a Python literal module
+def exportCache(module_path, name, cache_dict):
+    cache_file = open(module_path, 'w')
+    cache_file.write("{} = {{\n".format(name))
+
+    i = 1
+    for key in cache_dict:
+        cache_file.write("  \'{}\': {}".format(key, cache_dict[key]))
+        if i < len(cache_dict):
+            cache_file.write(",\n")
+        else:
+            cache_file.write("\n")
+        i += 1
+
+    cache_file.write("}\n")
+    cache_file.close()
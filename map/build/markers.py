@@ -0,0 +1,245 @@
+# This module keeps the markers of the map indexed by their
+# coordinates, so a photo can be attached to its marker with
+# a single dictionary lookup instead of a scan over all markers.
+# Markers can also be clustered by proximity on a spatial hash, so
+# photos a few metres apart share the same marker
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import math
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Maximum depth of the quadtree markers are ordered on
+max_quadtree_depth = 24
+
+# Mean radius of the Earth, in metres
+earth_radius = 6371008.8
+
+# Length of a degree of latitude, in metres
+metres_per_degree = earth_radius * math.pi / 180
+
+
+# ===============================================================
+
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the key that identifies a marker on the index.
+# Coordinates are compared by exact equality, as they always were
+def getMarkerKey(longitude, latitude):
+    return (longitude, latitude)
+
+# Create an index of the markers already on locations dictionary.
+# If the same coordinate appears more than once, the first marker wins
+def indexLocations(locations_dict):
+    markers_index = dict()
+    for country in locations_dict:
+        for marker in locations_dict[country]:
+            key = getMarkerKey(marker[0][0], marker[0][1])
+            if key not in markers_index:
+                markers_index[key] = marker
+    return markers_index
+
+# Add a photo to the marker on its coordinates, or create a new
+# marker if there is none yet. Returns True if a marker was created
+def addPhoto(markers_index, coords, longitude, latitude, photo_id, thumb_url):
+    key = getMarkerKey(longitude, latitude)
+    marker = markers_index.get(key)
+    if marker is None:
+        marker = [[longitude, latitude], [[photo_id, thumb_url]]]
+        markers_index[key] = marker
+        coords.append(marker)
+        return True
+    marker[1].append([photo_id, thumb_url])
+    return False
+
+# Merge the markers extracted from the photos into the markers already
+# on locations dictionary. Photos are added to the existing marker on
+# the same coordinate, skipping the ones already on it. The set of ids
+# of a marker is only built when a new photo lands on it, so the cost
+# depends on the number of markers and new photos, not on the map size.
+# Returns the number of photos added to existing markers and the list
+# of markers that have no match on the map yet
+def mergeMarkers(locations_dict, coords):
+    locations_index = indexLocations(locations_dict)
+    photo_ids = dict()
+    remaining_coords = []
+    new_photos = 0
+
+    for marker_info in coords:
+        key = getMarkerKey(marker_info[0][0], marker_info[0][1])
+        marker = locations_index.get(key)
+
+        if marker is None:
+            remaining_coords.append(marker_info)
+            continue
+
+        marker_ids = photo_ids.get(key)
+        if marker_ids is None:
+            marker_ids = set(photo[0] for photo in marker[1])
+            photo_ids[key] = marker_ids
+
+        for photo in marker_info[1]:
+            if photo[0] not in marker_ids:
+                marker[1].append([photo[0], photo[1]])
+                marker_ids.add(photo[0])
+                new_photos += 1
+
+    return new_photos, remaining_coords
+
+# Function to get the distance, in metres, between two coordinates.
+# The equirectangular approximation is precise enough for the
+# short distances markers are clustered by
+def getDistance(lon1, lat1, lon2, lat2):
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return earth_radius * math.sqrt(x*x + y*y)
+
+# Function to get the cell of a coordinate on a spatial
+# hash whose cells are 'cell_size' degrees wide
+def getGridCell(longitude, latitude, cell_size):
+    return int(math.floor(longitude / cell_size)), int(math.floor(latitude / cell_size))
+
+# Find the marker of a spatial hash nearest to a coordinate, within
+# 'distance' metres, or None. A degree of longitude is shorter than
+# one of latitude away from the equator, so more columns are searched
+def findNearestMarker(grid, longitude, latitude, distance):
+    cell_size = distance / metres_per_degree
+    col, row = getGridCell(longitude, latitude, cell_size)
+    cos_lat = math.cos(math.radians(min(89.0, abs(latitude) + cell_size)))
+    cols = int(math.ceil(1 / cos_lat))
+
+    nearest = None
+    nearest_distance = distance
+    for r in range(row-1, row+2):
+        for c in range(col-cols, col+cols+1):
+            for marker in grid.get((c, r), []):
+                marker_distance = getDistance(longitude, latitude, marker[0][0], marker[0][1])
+                if marker_distance <= nearest_distance:
+                    nearest = marker
+                    nearest_distance = marker_distance
+    return nearest
+
+# Add a marker to a spatial hash of markers
+def addToGrid(grid, marker, distance):
+    cell = getGridCell(marker[0][0], marker[0][1], distance / metres_per_degree)
+    grid.setdefault(cell, []).append(marker)
+
+# Cluster the markers extracted from the photos, and the markers already
+# on locations dictionary, by proximity. Each marker joins the nearest
+# marker within 'distance' metres, if there is one, and otherwise starts
+# a new cluster. The first marker of a cluster is its representative, so
+# markers already on map keep their coordinates. Photos already on a
+# marker are skipped. Returns the number of photos added to existing
+# markers and the list of new clustered markers, as 'mergeMarkers' does
+def clusterMarkers(locations_dict, coords, distance):
+    grid = dict()
+    map_markers = set()
+    photo_ids = dict()
+    remaining_coords = []
+    new_photos = 0
+
+    for country in locations_dict:
+        for marker in locations_dict[country]:
+            addToGrid(grid, marker, distance)
+            map_markers.add(id(marker))
+
+    for marker_info in coords:
+        marker = findNearestMarker(grid, marker_info[0][0], marker_info[0][1], distance)
+
+        if marker is None:
+            addToGrid(grid, marker_info, distance)
+            remaining_coords.append(marker_info)
+            continue
+
+        marker_ids = photo_ids.get(id(marker))
+        if marker_ids is None:
+            marker_ids = set(photo[0] for photo in marker[1])
+            photo_ids[id(marker)] = marker_ids
+
+        for photo in marker_info[1]:
+            if photo[0] not in marker_ids:
+                marker[1].append([photo[0], photo[1]])
+                marker_ids.add(photo[0])
+                if id(marker) in map_markers:
+                    new_photos += 1
+
+    return new_photos, remaining_coords
+
+# Remove photos from the markers on locations dictionary. Markers left
+# without photos are removed, and so are the countries left without
+# markers. The number of markers and photos of the remaining countries
+# are updated. Returns the number of photos and markers removed
+def removePhotos(locations_dict, countries_dict, photo_ids):
+    n_photos = 0
+    n_markers = 0
+
+    for country in list(locations_dict):
+        kept_markers = []
+        country_photos = 0
+
+        for marker in locations_dict[country]:
+            photos_info = [photo for photo in marker[1] if photo[0] not in photo_ids]
+            n_photos += len(marker[1]) - len(photos_info)
+            if len(photos_info) > 0:
+                marker[1] = photos_info
+                kept_markers.append(marker)
+                country_photos += len(photos_info)
+            else:
+                n_markers += 1
+
+        if len(kept_markers) > 0:
+            locations_dict[country] = kept_markers
+            if country in countries_dict:
+                countries_dict[country][1] = len(kept_markers)
+                countries_dict[country][2] = country_photos
+        else:
+            del locations_dict[country]
+            countries_dict.pop(country, None)
+
+    return n_photos, n_markers
+
+# Create an index of the photos on locations dictionary,
+# mapping the id of each photo to its marker
+def indexPhotos(locations_dict):
+    photos_index = dict()
+    for country in locations_dict:
+        for marker in locations_dict[country]:
+            for photo in marker[1]:
+                photos_index[photo[0]] = marker
+    return photos_index
+
+# Order the markers of a country so any prefix of the list covers its
+# area evenly. The markers are split on a quadtree and the order of a
+# node takes, in turns, the next marker of each of its quadrants. On a
+# leaf the markers with more photos come first. The order depends only
+# on the markers, so it's the same on every run
+def orderMarkers(markers):
+    if len(markers) <= 1:
+        return list(markers)
+    west = min(marker[0][0] for marker in markers)
+    south = min(marker[0][1] for marker in markers)
+    east = max(marker[0][0] for marker in markers)
+    north = max(marker[0][1] for marker in markers)
+    return orderQuadrant(markers, west, south, east, north, 0)
+
+def orderQuadrant(markers, west, south, east, north, depth):
+    if len(markers) <= 1 or depth >= max_quadtree_depth or (west == east and south == north):
+        return sorted(markers, key=lambda marker: (-len(marker[1]), marker[0][0], marker[0][1], marker[1][0][0]))
+
+    lon = (west + east) / 2
+    lat = (south + north) / 2
+    quadrants = [[], [], [], []]
+    for marker in markers:
+        quadrants[(marker[0][0] > lon) + 2 * (marker[0][1] > lat)].append(marker)
+
+    bounds = [(west, south, lon, lat), (lon, south, east, lat), (west, lat, lon, north), (lon, lat, east, north)]
+    orders = [orderQuadrant(quadrants[i], *bounds[i], depth+1) for i in range(4) if len(quadrants[i]) > 0]
+
+    ordered = []
+    for i in range(max(len(order) for order in orders)):
+        for order in orders:
+            if i < len(order):
+                ordered.append(order[i])
+    return ordered
@@ -0,0 +1,200 @@
+# This module instruments a run of the map builder. It keeps the time
+# spent on each phase of the run (how many times it ran, for how long
+# and the peak memory of the process by its end), a latency histogram
+# of the calls of each api method, along with their errors, and
+# counters of the run. At the end of the run all of them are written
+# to a json file, one per run, so runs can be charted and compared
+# over time. Only the files of the last runs are kept
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import bisect
+import json
+import os
+import threading
+import sys
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Upper bounds, in seconds, of the buckets of the latency
+# histograms. The last bucket has the slower calls
+latency_buckets = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the peak memory of the process, in MB, or None
+# where it's not available. On Linux it's read from /proc, as the
+# peak of getrusage is kept across exec, so a process started by a
+# larger one would report the peak of its parent. getrusage reports
+# it in kB on other systems, but in bytes on macOS
+def getPeakMemory():
+    try:
+        with open('/proc/self/status', 'r') as status_file:
+            for line in status_file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak /= 1024.0
+    return peak / 1024.0
+
+# Function to get the name of the metrics file of a run
+def getMetricsName(run_start):
+    return 'metrics-{}.json'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(run_start)))
+
+# Remove the metrics files on folder 'path' but the ones of the last
+# 'keep' runs. Their names sort in the order the runs started
+def removeOldMetrics(path, keep):
+    names = sorted(name for name in os.listdir(path) if name.startswith('metrics-') and name.endswith('.json'))
+    for name in names[:-keep]:
+        os.remove(os.path.join(path, name))
+
+
+#===== CLASSES ================================================================#
+
+# Metrics of a run. Api calls may be timed from several threads
+class Metrics:
+
+    def __init__(self, run_start=None):
+        self.run_start = int(time.time()) if run_start is None else run_start
+        self.started = time.perf_counter()
+        self.phases = dict()
+        self.calls = dict()
+        self.counters = dict()
+        self.lock = threading.Lock()
+
+    # Add the time of a phase, which may run more than once
+    def addPhase(self, name, elapsed):
+        peak_mb = getPeakMemory()
+        with self.lock:
+            phase = self.phases.setdefault(name, {'count': 0, 'time': 0.0, 'peak_mb': peak_mb})
+            phase['count'] += 1
+            phase['time'] += elapsed
+            if peak_mb is not None:
+                phase['peak_mb'] = max(phase['peak_mb'], peak_mb)
+
+    # Time the block of a 'with' statement as a phase
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addPhase(name, time.perf_counter() - start)
+
+    # Generator of the items of 'items', timing the wait for each
+    # one as a phase. Closing it closes 'items' as well
+    def timeItems(self, name, items):
+        iterator = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.addPhase(name, time.perf_counter() - start)
+                yield item
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+
+    # Add an api call that took 'elapsed' seconds
+    def addCall(self, method, elapsed, failed=False):
+        with self.lock:
+            call = self.calls.get(method)
+            if call is None:
+                call = {'calls': 0, 'errors': 0, 'time': 0.0, 'max': 0.0, 'histogram': [0] * (len(latency_buckets) + 1)}
+                self.calls[method] = call
+            call['calls'] += 1
+            call['time'] += elapsed
+            call['max'] = max(call['max'], elapsed)
+            call['histogram'][bisect.bisect_left(latency_buckets, elapsed)] += 1
+            if failed:
+                call['errors'] += 1
+
+    # Call 'function' as a call of api method 'method'
+    def timeCall(self, method, function):
+        start = time.perf_counter()
+        try:
+            result = function()
+        except BaseException:
+            self.addCall(method, time.perf_counter() - start, True)
+            raise
+        self.addCall(method, time.perf_counter() - start)
+        return result
+
+    # Same as 'timeCall', for a coroutine function
+    async def timeCallAsync(self, method, function):
+        start = time.perf_counter()
+        try:
+            result = await function()
+        except BaseException:
+            self.addCall(method, time.perf_counter() - start, True)
+            raise
+        self.addCall(method, time.perf_counter() - start)
+        return result
+
+    # Set the value of a counter of the run
+    def setCounter(self, name, value):
+        self.counters[name] = value
+
+    # Add 'value' to a counter of the run
+    def addCounter(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Get the metrics as a dictionary to be written as json
+    def getReport(self):
+        api = dict()
+        for method, call in self.calls.items():
+            api[method] = {
+                'calls': call['calls'],
+                'errors': call['errors'],
+                'time': round(call['time'], 4),
+                'mean': round(call['time'] / call['calls'], 4),
+                'max': round(call['max'], 4),
+                'buckets': latency_buckets,
+                'histogram': call['histogram']
+            }
+        phases = dict()
+        for name, phase in self.phases.items():
+            phases[name] = {'count': phase['count'], 'time': round(phase['time'], 4)}
+            if phase['peak_mb'] is not None:
+                phases[name]['peak_mb'] = round(phase['peak_mb'], 2)
+        return {
+            'run_start': self.run_start,
+            'duration': round(time.perf_counter() - self.started, 4),
+            'phases': phases,
+            'api': api,
+            'counters': self.counters
+        }
+
+    # Write the metrics to a json file on folder 'path', keeping
+    # the files of the last 'keep' runs only (0 to keep all of
+    # them). Returns the path of the file
+    def write(self, path, keep=0):
+        os.makedirs(path, exist_ok=True)
+        metrics_path = os.path.join(path, getMetricsName(self.run_start))
+        with open("{}.tmp".format(metrics_path), 'w') as metrics_file:
+            json.dump(self.getReport(), metrics_file, indent=2)
+        os.replace("{}.tmp".format(metrics_path), metrics_path)
+        if keep > 0:
+            removeOldMetrics(path, keep)
+        return metrics_path
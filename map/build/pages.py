@@ -0,0 +1,61 @@
+# This module fetches the pages of photos from Flickr, one at a time,
+# with a bounded pool of workers or on an asyncio event loop, always
+# handing them back in page order so they are processed as they were
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import asyncio
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+#===== FUNCTIONS ==============================================================#
+
+# Generator of the pages 'first_pg' to 'npages', as (page number, page)
+# tuples. With more than one worker, up to 'workers' pages are fetched at
+# the same time. Stopping the iteration cancels the pages not fetched yet
+def fetchPages(getPage, npages, workers=1, first_pg=1):
+
+    if workers <= 1:
+        for pg in range(first_pg, npages+1):
+            yield pg, getPage(pg)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    next_pg = first_pg
+
+    try:
+        while len(pending) > 0 or next_pg <= npages:
+            # keep the pool busy with the next pages
+            while next_pg <= npages and len(pending) < workers:
+                pending.append((next_pg, executor.submit(getPage, next_pg)))
+                next_pg += 1
+            pg, future = pending.popleft()
+            yield pg, future.result()
+    finally:
+        for pg, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+# Generator of the pages 'first_pg' to 'npages' fetched with the coroutine
+# function 'getPage' on the event loop 'loop'. Up to 'window' pages
+# are requested ahead, so the next pages are already on their way
+# while a page is being processed
+def fetchPagesAsync(loop, getPage, npages, window=1, first_pg=1):
+
+    pending = deque()
+    next_pg = first_pg
+
+    try:
+        while len(pending) > 0 or next_pg <= npages:
+            while next_pg <= npages and len(pending) < max(1, window):
+                pending.append((next_pg, loop.create_task(getPage(next_pg))))
+                next_pg += 1
+            pg, task = pending.popleft()
+            yield pg, loop.run_until_complete(task)
+    finally:
+        for pg, task in pending:
+            task.cancel()
+        if len(pending) > 0:
+            loop.run_until_complete(asyncio.gather(*[task for pg, task in pending], return_exceptions=True))
@@ -0,0 +1,152 @@
+# This module builds a pyramid of clusters of the markers, one level
+# per zoom of the map, the way supercluster does on the browser. Each
+# level clusters the one above it on a spatial hash, so building it
+# costs about the same for every level. The page then only has to add
+# the clusters of the current zoom instead of every single marker
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import math
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Radius, in pixels, of a cluster
+cluster_radius = 60
+
+# Size, in pixels, of the tiles of the map
+tile_size = 512
+
+# Zoom levels of the pyramid
+min_zoom = 0
+max_zoom = 16
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Functions to project coordinates on web mercator, in the
+# range 0 to 1, and to get them back
+def projectX(longitude):
+    return longitude / 360 + 0.5
+
+def projectY(latitude):
+    sin = math.sin(math.radians(max(-85.0511, min(85.0511, latitude))))
+    return 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi
+
+def unprojectX(x):
+    return (x - 0.5) * 360
+
+def unprojectY(y):
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+# Cluster the points of a level for zoom 'zoom'. A point is a list of
+# [x, y, photos, markers, bbox, thumb url, marker reference]. Points are
+# visited from the one with most photos, and each takes the points not
+# yet clustered within the radius. A cluster is on the mean of its
+# points, weighted by photos, and its thumbnail is the one of its point
+# with most photos
+def clusterLevel(points, zoom):
+    radius = cluster_radius / float(tile_size * 2 ** zoom)
+    radius_2 = radius * radius
+    cells = [(int(point[0] // radius), int(point[1] // radius)) for point in points]
+    grid = dict()
+    for i, cell in enumerate(cells):
+        grid.setdefault(cell, []).append(i)
+
+    order = sorted(range(len(points)), key=lambda i: -points[i][2])
+    clustered = [False] * len(points)
+    clusters = []
+
+    for i in order:
+        if clustered[i]:
+            continue
+        clustered[i] = True
+        point = points[i]
+        x = point[0]
+        y = point[1]
+        members = [point]
+        col, row = cells[i]
+        for cell in ((col-1, row-1), (col, row-1), (col+1, row-1),
+                     (col-1, row), (col, row), (col+1, row),
+                     (col-1, row+1), (col, row+1), (col+1, row+1)):
+            for j in grid.get(cell, ()):
+                if not clustered[j]:
+                    other = points[j]
+                    if (other[0] - x) ** 2 + (other[1] - y) ** 2 <= radius_2:
+                        clustered[j] = True
+                        members.append(other)
+
+        if len(members) == 1:
+            clusters.append(point)
+            continue
+
+        photos = sum(member[2] for member in members)
+        clusters.append([
+            sum(member[0] * member[2] for member in members) / photos,
+            sum(member[1] * member[2] for member in members) / photos,
+            photos,
+            sum(member[3] for member in members),
+            [min(member[4][0] for member in members), min(member[4][1] for member in members),
+             max(member[4][2] for member in members), max(member[4][3] for member in members)],
+            point[5],
+            None
+        ])
+
+    return clusters
+
+# Build the pyramid of clusters of the markers on locations dictionary.
+# Returns a dictionary of the clusters of each zoom, from the lowest zoom
+# to the highest one where markers are still clustered. A cluster is
+# [longitude, latitude, photos, markers, bbox, thumb url], and a single
+# marker is [country code, index of the marker on its country]
+def buildPyramid(locations_dict):
+    points = []
+    for country_code in locations_dict:
+        for index, marker in enumerate(locations_dict[country_code]):
+            longitude = marker[0][0]
+            latitude = marker[0][1]
+            points.append([projectX(longitude), projectY(latitude), len(marker[1]), 1,
+                           [longitude, latitude, longitude, latitude], marker[1][0][1], [country_code, index]])
+
+    n_markers = len(points)
+    levels = dict()
+    for zoom in range(max_zoom, min_zoom-1, -1):
+        points = clusterLevel(points, zoom)
+        levels[zoom] = points
+
+    # above the highest zoom that clusters anything the
+    # markers are shown on their own, so it's the top level
+    top_zoom = min_zoom
+    for zoom in range(max_zoom, min_zoom-1, -1):
+        if len(levels[zoom]) < n_markers:
+            top_zoom = zoom
+            break
+
+    pyramid = dict()
+    for zoom in range(min_zoom, top_zoom+1):
+        pyramid[zoom] = []
+        for point in levels[zoom]:
+            if point[3] == 1:
+                pyramid[zoom].append(point[6])
+            else:
+                pyramid[zoom].append([round(unprojectX(point[0]), 6), round(unprojectY(point[1]), 6),
+                                      point[2], point[3], point[4], point[5]])
+    return pyramid
+
+# Write the pyramid of clusters to file
+def writePyramid(path, pyramid):
+    clusters_file = open(path, 'w')
+    clusters_file.write("clusters_dict = {\n")
+
+    i = 1
+    for zoom in pyramid:
+        clusters_file.write("  {}: {}".format(zoom, pyramid[zoom]))
+        if i < len(pyramid):
+            clusters_file.write(",\n")
+        else:
+            clusters_file.write("\n")
+        i += 1
+
+    clusters_file.write("}\n")
+    clusters_file.close()
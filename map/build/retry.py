@@ -0,0 +1,140 @@
+# This module implements the retry policy of the api calls: failed
+# calls are tried again after an exponential backoff with jitter, all
+# calls share a token bucket that keeps them under a requests per hour
+# budget, and errors that will not go away by trying again are fatal
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import asyncio
+import random
+import threading
+import time
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Flickr api error codes that will fail again on every try
+# (not found, invalid api key, format or method not found, etc.)
+fatal_error_codes = [1, 2, 95, 96, 97, 98, 99, 100, 111, 112, 114, 115, 116]
+
+# HTTP status codes, besides 5xx, that are worth trying again
+retryable_status = [408, 429]
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the HTTP status of an error, if there is one
+def getErrorStatus(e):
+    status = getattr(e, 'status', None)
+    if status is None:
+        response = getattr(e, 'response', None)
+        status = getattr(response, 'status_code', None)
+    return status
+
+# Function to verify if a failed call is worth trying again
+def isRetryable(e):
+    code = getattr(e, 'code', None)
+    if code is not None:
+        try:
+            if int(code) in fatal_error_codes:
+                return False
+        except (TypeError, ValueError):
+            pass
+    status = getErrorStatus(e)
+    if status is not None and 400 <= int(status) < 500:
+        return int(status) in retryable_status
+    return True
+
+
+#===== CLASSES ================================================================#
+
+# Token bucket shared by all api calls. Each call takes a token and
+# tokens are refilled at the budget rate, up to 'burst' tokens
+class RateLimiter:
+
+    def __init__(self, requests_per_hour, burst=60):
+        self.rate = requests_per_hour / 3600.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.waited = 0.0
+
+    # Take a token and return how long to wait before using it
+    def reserve(self):
+        if self.rate <= 0:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            delay = -self.tokens / self.rate
+            self.waited += delay
+            return delay
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def waitAsync(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# Policy to call a function, trying again on retryable errors
+class RetryPolicy:
+
+    def __init__(self, max_tries=10, base_delay=1.0, max_delay=60.0, limiter=None):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = limiter
+        self.retries = 0
+
+    # Exponential backoff with full jitter
+    def getDelay(self, tries):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (tries-1)))
+
+    # Verify if a call that failed on try 'tries' will be tried again
+    def willRetry(self, e, tries):
+        return tries < self.max_tries and isRetryable(e)
+
+    # Call 'function' until it succeeds. Before each new try 'onRetry'
+    # is called with the error, the try number and the delay. The error
+    # of the last try, or of a fatal error, is raised to the caller
+    def call(self, function, onRetry=None):
+        for tries in range(1, self.max_tries+1):
+            if self.limiter is not None:
+                self.limiter.wait()
+            try:
+                return function()
+            except Exception as e:
+                if not self.willRetry(e, tries):
+                    raise
+                delay = self.getDelay(tries)
+                self.retries += 1
+                if onRetry is not None:
+                    onRetry(e, tries, delay)
+                time.sleep(delay)
+
+    # Same as 'call', for a coroutine function
+    async def callAsync(self, function, onRetry=None):
+        for tries in range(1, self.max_tries+1):
+            if self.limiter is not None:
+                await self.limiter.waitAsync()
+            try:
+                return await function()
+            except Exception as e:
+                if not self.willRetry(e, tries):
+                    raise
+                delay = self.getDelay(tries)
+                self.retries += 1
+                if onRetry is not None:
+                    onRetry(e, tries, delay)
+                await asyncio.sleep(delay)
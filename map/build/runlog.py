@@ -0,0 +1,191 @@
+# This module writes the log of the map builder. Each record is a line
+# with its time, level and message, plus optional fields as key=value
+# pairs, so the log can be filtered and parsed. Records are kept on a
+# buffer and written to the file in large blocks, when the buffer is
+# full, on errors, with each progress record written and when the log
+# is closed. Progress records (such as the markers added) are rate
+# limited, so only the newest one after an interval is written, and
+# the file is rotated when it grows past its maximum size. The log can
+# also be written as a file, so the messages written to it as plain
+# text are records as well. Records can be added from any thread
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import json
+import os
+import threading
+import time
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Levels of the records, from the least severe
+levels = ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+# Bytes of records kept on the buffer before writing them
+buffer_size = 65536
+
+# Defaults of the level of the records written, of the maximum size
+# of the file, in bytes, and of the number of rotated files kept
+default_level = 'INFO'
+default_max_size = 1048576
+default_backups = 3
+
+# Default of the minimum number of seconds between progress records
+default_progress_interval = 10.0
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the level of a plain text message
+def getMessageLevel(message):
+    if message.startswith('ERROR: FATAL:'):
+        return 'CRITICAL'
+    if message.startswith('ERROR:'):
+        return 'ERROR'
+    return 'INFO'
+
+# Function to get the text of the fields of a record
+def getFieldsText(fields):
+    text = ''
+    for key in fields:
+        value = fields[key]
+        if isinstance(value, str):
+            value = json.dumps(value)
+        elif isinstance(value, float):
+            value = round(value, 4)
+        text += ' {}={}'.format(key, value)
+    return text
+
+
+#===== CLASSES ================================================================#
+
+# Buffered log file, with levels, rate limited progress and rotation
+class RunLog:
+
+    def __init__(self, path, level=default_level, max_size=default_max_size, backups=default_backups, progress_interval=default_progress_interval):
+        self.path = path
+        self.level = levels.index(level)
+        self.max_size = max_size
+        self.backups = backups
+        self.progress_interval = progress_interval
+        self.buffer = []
+        self.buffered = 0
+        self.counts = dict((name, 0) for name in levels)
+        self.pending = None
+        self.last_progress = None
+        self.closed = False
+        # reentrant, as adding a record can flush the buffer
+        self.lock = threading.RLock()
+        # fail now, as opening the file to append would, if it can't be written
+        open(self.path, 'a').close()
+
+    def setLevel(self, level):
+        self.level = levels.index(level)
+
+    # Add a record to the buffer, if its level is written
+    def log(self, level, message, **fields):
+        with self.lock:
+            self.counts[level] += 1
+            if levels.index(level) < self.level:
+                return
+            if self.pending is not None:
+                self.addRecord(*self.pending)
+                self.pending = None
+            self.addRecord(time.time(), level, message, fields)
+            if levels.index(level) >= levels.index('ERROR'):
+                self.flush()
+
+    # Format a record created at time 'created'
+    def formatRecord(self, created, level, message, fields):
+        return '{} {:<8} {}{}\n'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)), level, message, getFieldsText(fields))
+
+    def addRecord(self, created, level, message, fields):
+        record = self.formatRecord(created, level, message, fields)
+        with self.lock:
+            self.buffer.append(record)
+            self.buffered += len(record)
+            if self.buffered >= buffer_size:
+                self.flush()
+
+    def debug(self, message, **fields):
+        self.log('DEBUG', message, **fields)
+
+    def info(self, message, **fields):
+        self.log('INFO', message, **fields)
+
+    def warning(self, message, **fields):
+        self.log('WARNING', message, **fields)
+
+    def error(self, message, **fields):
+        self.log('ERROR', message, **fields)
+
+    def critical(self, message, **fields):
+        self.log('CRITICAL', message, **fields)
+
+    # Add a progress record. Records that come before the interval
+    # has passed are held, and only the newest one is written, with
+    # the next record or when the log is flushed, with the time it
+    # was added. The ones written are flushed to the file, so a run
+    # that is killed leaves its progress. On level DEBUG all progress
+    # records are written, and flushed only with the buffer
+    def progress(self, message, **fields):
+        with self.lock:
+            if self.level <= levels.index('DEBUG'):
+                self.addRecord(time.time(), 'DEBUG', message, fields)
+                return
+            now = time.monotonic()
+            if self.last_progress is None or now - self.last_progress >= self.progress_interval:
+                self.pending = None
+                self.last_progress = now
+                self.addRecord(time.time(), 'INFO', message, fields)
+                self.flush()
+            else:
+                self.pending = (time.time(), 'INFO', message, fields)
+
+    # Add the summary record of a run
+    def summary(self, status, **fields):
+        with self.lock:
+            fields['errors'] = self.counts['ERROR'] + self.counts['CRITICAL']
+            fields['warnings'] = self.counts['WARNING']
+            self.log('INFO', 'Run summary', status=status, **fields)
+
+    # Add plain text as records, one per line
+    def write(self, text):
+        for line in text.splitlines():
+            if line.strip() != '':
+                self.log(getMessageLevel(line), line.strip())
+
+    # Rotate the file, if adding 'size' bytes would take it past its maximum size
+    def rotate(self, size):
+        if self.max_size <= 0 or not os.path.exists(self.path) or os.path.getsize(self.path) + size <= self.max_size:
+            return
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups-1, 0, -1):
+            if os.path.exists("{}.{}".format(self.path, i)):
+                os.replace("{}.{}".format(self.path, i), "{}.{}".format(self.path, i+1))
+        os.replace(self.path, "{}.1".format(self.path))
+
+    # Write the records on the buffer to the file
+    def flush(self):
+        with self.lock:
+            if self.pending is not None:
+                self.buffer.append(self.formatRecord(*self.pending))
+                self.pending = None
+            if len(self.buffer) == 0:
+                return
+            content = ''.join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            self.rotate(len(content))
+            with open(self.path, 'a') as log_file:
+                log_file.write(content)
+
+    def close(self):
+        with self.lock:
+            if not self.closed:
+                self.flush()
+                self.closed = True
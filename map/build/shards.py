@@ -0,0 +1,117 @@
+# This module writes the markers of the map as one file per country,
+# plus a small manifest with the number of markers and photos, the
+# bounding box and the content hash of each file. The page loads the
+# manifest first and each country file only when it's needed, so the
+# first paint doesn't depend on the size of the map. Files whose
+# content didn't change are not written again
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import hashlib
+import json
+import os
+
+from geocache import importCache
+
+
+# ================= CONFIGURATION VARIABLES =====================
+
+# Folder of the country files, relative to the map files
+shards_dir = 'locations'
+
+# Manifest of the country files
+manifest_file = 'locations_manifest.py'
+
+
+# ===============================================================
+
+#===== FUNCTIONS ==============================================================#
+
+# Function to get the file name of a country. Markers with no
+# country, or an unknown one, get a name that is a valid file name
+def getShardName(country_code):
+    if country_code.isalnum():
+        return '{}.json'.format(country_code)
+    return '_{}.json'.format(country_code.encode('utf-8').hex())
+
+# Function to get the bounding box of a list of markers
+def getShardBbox(markers):
+    return [min(marker[0][0] for marker in markers), min(marker[0][1] for marker in markers),
+            max(marker[0][0] for marker in markers), max(marker[0][1] for marker in markers)]
+
+# Verify if there are country files on 'path'
+def hasShards(path):
+    return os.path.exists(os.path.join(path, manifest_file))
+
+# Load the manifest of the country files
+def loadManifest(path):
+    return importCache(os.path.join(path, manifest_file), 'locations_manifest')
+
+# Load the markers of all country files as a locations dictionary
+def loadShards(path):
+    locations_dict = dict()
+    manifest = loadManifest(path)
+    for country_code in manifest:
+        with open(os.path.join(path, manifest[country_code]['file']), 'r') as shard_file:
+            locations_dict[country_code] = json.load(shard_file)
+    return locations_dict
+
+# Write the markers of locations dictionary as one file per country,
+# and the manifest of the files. Files of countries no longer on
+# map are removed
+def writeShards(path, locations_dict):
+    os.makedirs(os.path.join(path, shards_dir), exist_ok=True)
+
+    old_manifest = dict()
+    if hasShards(path):
+        old_manifest = loadManifest(path)
+
+    manifest = dict()
+    for country_code in locations_dict:
+        markers = locations_dict[country_code]
+        if len(markers) == 0:
+            continue
+
+        content = json.dumps(markers, separators=(',', ':'))
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+        shard_path = '{}/{}'.format(shards_dir, getShardName(country_code))
+
+        old_shard = old_manifest.get(country_code)
+        if old_shard is None or old_shard['hash'] != content_hash or not os.path.exists(os.path.join(path, shard_path)):
+            with open(os.path.join(path, "{}.tmp".format(shard_path)), 'w') as shard_file:
+                shard_file.write(content)
+            os.replace(os.path.join(path, "{}.tmp".format(shard_path)), os.path.join(path, shard_path))
+
+        manifest[country_code] = {
+            'file': shard_path,
+            'markers': len(markers),
+            'photos': sum(len(marker[1]) for marker in markers),
+            'bbox': getShardBbox(markers),
+            'hash': content_hash
+        }
+
+    manifest_path = os.path.join(path, manifest_file)
+    with open("{}.tmp".format(manifest_path), 'w') as manifest_out:
+        manifest_out.write("locations_manifest = {\n")
+        i = 1
+        for country_code in manifest:
+            manifest_out.write("  \'{}\': {}".format(country_code, json.dumps(manifest[country_code])))
+            if i < len(manifest):
+                manifest_out.write(",\n")
+            else:
+                manifest_out.write("\n")
+            i += 1
+        manifest_out.write("}\n")
+    os.replace("{}.tmp".format(manifest_path), manifest_path)
+
+    shard_paths = set(manifest[country_code]['file'] for country_code in manifest)
+    for shard_name in os.listdir(os.path.join(path, shards_dir)):
+        if '{}/{}'.format(shards_dir, shard_name) not in shard_paths:
+            os.remove(os.path.join(path, shards_dir, shard_name))
+
+# Remove the country files and their manifest
+def removeShards(path):
+    if hasShards(path):
+        for country_code, shard in loadManifest(path).items():
+            if os.path.exists(os.path.join(path, shard['file'])):
+                os.remove(os.path.join(path, shard['file']))
+        os.remove(os.path.join(path, manifest_file))
@@ -0,0 +1,95 @@
+# This module keeps the state of the incremental sync of the map:
+# the newest upload date of the photos already processed, the total
+# of photos on photostream, the date of the last run and the ids of
+# the photos on the map. With it a run only requests the photos
+# uploaded since the last run, deleted photos are found by comparing
+# ids instead of counting photos and photos with edited locations
+# are moved on the map
+#++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+import json
+import os
+
+from markers import getDistance
+
+
+#===== FUNCTIONS ==============================================================#
+
+# Load the sync state of the last run, or None if there is none
+# or it was saved for another user
+def loadSyncState(path, user_id):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as sync_file:
+            sync_state = json.load(sync_file)
+    except ValueError:
+        return None
+    if sync_state.get('user_id') != user_id:
+        return None
+    sync_state['photo_ids'] = set(sync_state.get('photo_ids', []))
+    return sync_state
+
+# Save the sync state for the next run. 'last_run' is the
+# date since when edited photos are checked on next run
+def saveSyncState(path, user_id, total, newest_upload, photo_ids, last_run=None):
+    sync_state = {
+        'user_id': user_id,
+        'total': total,
+        'newest_upload': newest_upload,
+        'last_run': last_run,
+        'photo_ids': sorted(photo_ids)
+    }
+    with open("{}.tmp".format(path), 'w') as sync_file:
+        json.dump(sync_state, sync_file)
+    os.replace("{}.tmp".format(path), path)
+
+# Get the ids of all photos on locations dictionary
+def getMappedPhotoIds(locations_dict):
+    photo_ids = set()
+    for country in locations_dict:
+        for marker in locations_dict[country]:
+            for photo in marker[1]:
+                photo_ids.add(photo[0])
+    return photo_ids
+
+# Get the newest upload date of a page of photos
+def getNewestUpload(page, newest_upload=0):
+    for photo in page:
+        upload = int(photo.get('dateupload', 0))
+        if upload > newest_upload:
+            newest_upload = upload
+    return newest_upload
+
+# Find, among the photos updated since last run, the ones whose place
+# on map changed: photos on map whose location was edited or that can
+# no longer be mapped, and photos uploaded before last run that can be
+# mapped now. Photos uploaded after 'newest_upload' are left to the
+# processing of the new uploads. With markers clustered, a photo still
+# within 'distance' metres of its marker was not moved. Returns the ids
+# of the photos to be removed from their markers and the photos to be
+# added to the map
+def getEditedPhotos(photos, photos_index, newest_upload, isMappable, distance=0):
+    removed_ids = set()
+    added_photos = []
+
+    for photo in photos:
+        if int(photo.get('dateupload', 0)) > newest_upload:
+            continue
+
+        mappable = isMappable(photo)
+        marker = photos_index.get(photo['id'])
+
+        if marker is not None:
+            longitude = float(photo['longitude'])
+            latitude = float(photo['latitude'])
+            if mappable and marker[0][0] == longitude and marker[0][1] == latitude:
+                continue
+            if mappable and distance > 0 and getDistance(longitude, latitude, marker[0][0], marker[0][1]) <= distance:
+                continue
+            removed_ids.add(photo['id'])
+
+        if mappable:
+            added_photos.append(photo)
+
+    return removed_ids, added_photos
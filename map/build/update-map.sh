@@ -6,21 +6,51 @@ BUILD_DIR="build"
 LOC_FILE="locations.py"
 CTY_FILE="countries.py"
 USR_FILE="user.py"
+CLS_FILE="clusters.py"
+MNF_FILE="locations_manifest.py"
+CMP_FILE="locations_compact.py"
+ART_FILE="artifacts.js"
+ART_DIR="assets"
+SHD_DIR="locations"
+CKP_FILE="checkpoint.jsonl"
 
-rm $REPO_DIR/$MAP_DIR/$BUILD_DIR/last_total.py
-rm $REPO_DIR/$MAP_DIR/$LOC_FILE
-rm $REPO_DIR/$MAP_DIR/$CTY_FILE
-rm $REPO_DIR/$MAP_DIR/$USR_FILE
+# set to "--sync" to update the map only with the changes
+# since the last run, instead of generating it from scratch
+SYNC_MODE=""
 
-$REPO_DIR/$MAP_DIR/$BUILD_DIR/generate-map-data.py
+# resume the previous run if it was interrupted,
+# otherwise update or generate the map from scratch
+if [[ -f $REPO_DIR/$MAP_DIR/$BUILD_DIR/$CKP_FILE ]];
+  then
+    $REPO_DIR/$MAP_DIR/$BUILD_DIR/generate-map-data.py --resume $SYNC_MODE
+elif [[ $SYNC_MODE == "--sync" ]];
+  then
+    $REPO_DIR/$MAP_DIR/$BUILD_DIR/generate-map-data.py --sync
+  else
+    rm $REPO_DIR/$MAP_DIR/$BUILD_DIR/last_total.py
+    rm $REPO_DIR/$MAP_DIR/$LOC_FILE
+    rm $REPO_DIR/$MAP_DIR/$CTY_FILE
+    rm $REPO_DIR/$MAP_DIR/$USR_FILE
+    rm -f $REPO_DIR/$MAP_DIR/$CLS_FILE
+    rm -f $REPO_DIR/$MAP_DIR/$MNF_FILE
+    rm -f $REPO_DIR/$MAP_DIR/$CMP_FILE
+    rm -fr $REPO_DIR/$MAP_DIR/$SHD_DIR
+    $REPO_DIR/$MAP_DIR/$BUILD_DIR/generate-map-data.py
+fi
 
-if [[ -f $REPO_DIR/$MAP_DIR/$LOC_FILE && -f $REPO_DIR/$MAP_DIR/$CTY_FILE ]];
+if [[ ( -f $REPO_DIR/$MAP_DIR/$LOC_FILE || -f $REPO_DIR/$MAP_DIR/$MNF_FILE || -f $REPO_DIR/$MAP_DIR/$CMP_FILE ) && -f $REPO_DIR/$MAP_DIR/$CTY_FILE ]];
   then
     cd $REPO_DIR
     git pull origin master
-    git add $MAP_DIR/$LOC_FILE
+    git add -A $MAP_DIR/$LOC_FILE 2> /dev/null
+    git add -A $MAP_DIR/$MNF_FILE 2> /dev/null
+    git add -A $MAP_DIR/$CMP_FILE 2> /dev/null
+    git add -A $MAP_DIR/$SHD_DIR 2> /dev/null
     git add $MAP_DIR/$CTY_FILE
     git add $MAP_DIR/$USR_FILE
+    git add -A $MAP_DIR/$CLS_FILE 2> /dev/null
+    git add -A $MAP_DIR/$ART_FILE 2> /dev/null
+    git add -A $MAP_DIR/$ART_DIR 2> /dev/null
     git commit -m "[auto] Updated Flickr Photos Map"
     git push origin master
     git push fork master
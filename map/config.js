@@ -1 +1 @@
-var max_init_n_markers = 2500;
+var max_init_n_markers = 1000;
@@ -145,7 +145,10 @@ function custom() {
     var bboxes = [];
     var padding = 50;
 
-    if (fitMarkers && region != 'WW') {
+    if (fitMarkers && region != 'WW' && !(region in locations_dict)) {
+        bboxes = locations_manifest[region]['bbox'];
+        padding += 100;
+    } else if (fitMarkers && region != 'WW') {
         bboxes = getCountryMarkersBbox(region);
         padding += 100;
     } else {